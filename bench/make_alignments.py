@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 18:51 PDT (-0700)
+
+Write synthetic PHYLIP loci over the taxa named in a sh_t config.
+"""
+
+import os
+import re
+import yaml
+import random
+import argparse
+
+from sh_t import core
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Write synthetic PHYLIP loci for benchmarking",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--config',
+        default=os.path.join(os.path.dirname(__file__), "..", "sh_t.yaml"),
+        help='The sh_t config whose taxa the loci use.',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--output',
+        required=True,
+        help='The directory to write loci to.',
+        action=core.FullPaths
+    )
+    parser.add_argument('--loci', type=int, default=100, help='The number of loci.')
+    parser.add_argument('--taxa', type=int, default=30, help='The number of taxa per locus.')
+    parser.add_argument('--sites', type=int, default=800, help='The number of sites per locus.')
+    parser.add_argument('--seed', type=int, default=1, help='The random seed.')
+    return parser.parse_args()
+
+
+def get_config_taxa(config):
+    """Return the taxon groups and every taxon in the config"""
+    groups = config["orders"].values()
+    taxa = set([taxon for group in groups for taxon in group])
+    for newick in config["constraints"].values():
+        taxa.update(re.findall(r"([^(),:;\s]+):", newick))
+    return groups, sorted(taxa)
+
+
+def make_locus(rng, groups, all_taxa, ntax, nchar):
+    # take one member of every group so the locus passes filtering
+    taxa = set([rng.choice(group) for group in groups])
+    others = [taxon for taxon in all_taxa if taxon not in taxa]
+    rng.shuffle(others)
+    taxa.update(others[:max(0, ntax - len(taxa))])
+    ancestor = [rng.choice("ACGT") for i in xrange(nchar)]
+    lines = ["{} {}".format(len(taxa), nchar)]
+    for taxon in sorted(taxa):
+        seq = [base if rng.random() > 0.05 else rng.choice("ACGT") for base in ancestor]
+        # ragged, gappy ends like UCE flanks
+        for i in xrange(rng.randrange(nchar // 10 + 1)):
+            seq[i] = "-"
+        for i in xrange(nchar - rng.randrange(nchar // 10 + 1), nchar):
+            seq[i] = "?"
+        lines.append("{}  {}".format(taxon, "".join(seq)))
+    return "\n".join(lines) + "\n"
+
+
+def write_loci(config, output, loci, ntax, nchar, seed=1):
+    rng = random.Random(seed)
+    groups, all_taxa = get_config_taxa(config)
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    for locus in xrange(loci):
+        with open(os.path.join(output, "uce-{}.phylip".format(locus)), "w") as outfile:
+            outfile.write(make_locus(rng, groups, all_taxa, ntax, nchar))
+
+
+def main():
+    args = get_args()
+    config = yaml.safe_load(open(args.config))
+    write_loci(config, args.output, args.loci, args.taxa, args.sites, args.seed)
+
+
+if __name__ == '__main__':
+    main()
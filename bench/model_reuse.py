@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 14:31 PDT (-0700)
+
+Compare wall time and likelihoods of runs that re-optimize GTRGAMMA
+parameters in every RAxML call against runs using --reuse-model.
+"""
+
+import os
+import sys
+import time
+import yaml
+import shutil
+import argparse
+import tempfile
+
+from sh_t import core
+from sh_t import constraints
+from sh_t.main import get_locus_jobs, get_best_likelihood
+from sh_t.scheduler import run_jobs
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark --reuse-model against full re-optimization",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--config',
+        default=os.path.join(os.path.dirname(__file__), "..", "sh_t.yaml"),
+        help='Path to a YAML config file with constraint info.',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--alignments',
+        default=os.path.join(os.path.dirname(__file__), "..", "test", "alignments"),
+        help='A directory of PHYLIP alignments.',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--searches',
+        type=int,
+        default=5,
+        help='The number of RAxML search reps to use.',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=12345,
+        help='The run seed, shared by both modes.',
+    )
+    return parser.parse_args()
+
+
+def run_locus(args, raxml, raxml_version, alignment, constraint_strings, reuse_model):
+    """Run one locus serially, returning stage times and likelihoods"""
+    output = tempfile.mkdtemp(prefix="sh_t-bench-")
+    run_args = argparse.Namespace(
+        output=output,
+        searches=args.searches,
+        seed=args.seed,
+        cache=None,
+        reuse_model=reuse_model,
+        shards=1,
+        replicates=1000,
+        compress=False,
+        scratch=None,
+        max_memory=None,
+        cores=1,
+        patterns_per_thread=1000,
+        adaptive=False
+    )
+    times = {}
+    lls = {}
+    try:
+        jobs = get_locus_jobs(run_args, raxml, raxml_version, alignment, constraint_strings)
+        start = time.time()
+        for job, result in run_jobs(jobs, 1):
+            if job.error is not None:
+                raise RuntimeError("Job {} failed:\n{}".format(job.name, job.error))
+            now = time.time()
+            times[job.stage] = times.get(job.stage, 0.) + now - start
+            start = now
+            if job.stage == "SHTEST":
+                for row in result[1]:
+                    name = os.path.basename(row[0]).split('.')[-3]
+                    lls[name] = float(row[1])
+            elif job.stage == "BEST":
+                lls["BEST"] = get_best_likelihood(result[0].replace("bestTree", "info"))
+    finally:
+        shutil.rmtree(output)
+    return times, lls
+
+
+def main():
+    args = get_args()
+    config = yaml.safe_load(open(args.config))
+    # run serially, so the stage times compare like with like
+    raxml = {"serial": core.which("raxmlHPC-SSE3"), "pthreads": None}
+    raxml_version = core.get_raxml_version(raxml["serial"])
+    constraints.load_constraint_trees(config["constraints"])
+    alignments = sorted(core.get_alignments(args.alignments))
+    group_names, coverage = core.get_taxon_group_coverage(alignments, config["orders"])
+    alignments = [a for a, ok in zip(alignments, coverage) if ok.all()]
+    print "{:<16}{:>12}{:>12}{:>10}{:>10}{:>10}{:>14}".format(
+        "locus", "time(full)", "time(reuse)", "speedup", "BEST dLL", "max dLL", "trees"
+    )
+    totals = [0., 0.]
+    for alignment in alignments:
+        full_times, full_lls = run_locus(args, raxml, raxml_version, alignment, config["constraints"], False)
+        reuse_times, reuse_lls = run_locus(args, raxml, raxml_version, alignment, config["constraints"], True)
+        full, reuse = sum(full_times.values()), sum(reuse_times.values())
+        totals[0] += full
+        totals[1] += reuse
+        deltas = [abs(full_lls[k] - reuse_lls[k]) for k in full_lls if k in reuse_lls and None not in (full_lls[k], reuse_lls[k])]
+        print "{:<16}{:>12.2f}{:>12.2f}{:>10.2f}{:>10.3f}{:>10.3f}{:>14}".format(
+            os.path.basename(alignment),
+            full,
+            reuse,
+            full / reuse if reuse else 0.,
+            abs((full_lls.get("BEST") or 0.) - (reuse_lls.get("BEST") or 0.)),
+            max(deltas) if deltas else 0.,
+            len(full_lls) - 1
+        )
+        sys.stdout.flush()
+    print "{:<16}{:>12.2f}{:>12.2f}{:>10.2f}".format(
+        "total",
+        totals[0],
+        totals[1],
+        totals[0] / totals[1] if totals[1] else 0.
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 19:14 PDT (-0700)
+
+Run sh_t end to end on synthetic loci against the stub RAxML in bench/bin,
+and report orchestration overhead, filesystem churn and parallel
+efficiency.  No network or real RAxML is needed.
+"""
+
+import os
+import sys
+import json
+import time
+import yaml
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+
+import sh_t
+from sh_t import core
+from make_alignments import write_loci
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark sh_t orchestration against a stub RAxML",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--config',
+        default=os.path.join(ROOT, "sh_t.yaml"),
+        help='The sh_t config to run.',
+        action=core.FullPaths
+    )
+    parser.add_argument('--loci', type=int, default=100, help='The number of loci.')
+    parser.add_argument('--taxa', type=int, default=30, help='The number of taxa per locus.')
+    parser.add_argument('--sites', type=int, default=800, help='The number of sites per locus.')
+    parser.add_argument('--cores', type=int, default=1, help='Passed to sh_t --cores.')
+    parser.add_argument('--searches', type=int, default=20, help='Passed to sh_t --searches.')
+    parser.add_argument('--delay', type=float, default=0.05, help='Stub seconds per RAxML call.')
+    parser.add_argument('--rate', type=float, default=0., help='Stub seconds per taxon x site x replicate.')
+    parser.add_argument(
+        '--record',
+        default=None,
+        help='Append the results as a JSON line to this file, to track regressions.',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--keep',
+        action='store_true',
+        default=False,
+        help='Keep the synthetic loci and sh_t output.',
+    )
+    parser.add_argument(
+        'sh_t_args',
+        nargs=argparse.REMAINDER,
+        help='Extra arguments for sh_t, after --.',
+    )
+    return parser.parse_args()
+
+
+def count_files(directory):
+    files, size = 0, 0
+    for root, dirs, names in os.walk(directory):
+        files += len(names)
+        size += sum([os.path.getsize(os.path.join(root, name)) for name in names])
+    return files, size
+
+
+def run(args, work):
+    alignments = os.path.join(work, "alignments")
+    output = os.path.join(work, "output")
+    start = time.time()
+    write_loci(yaml.safe_load(open(args.config)), alignments, args.loci, args.taxa, args.sites)
+    generate = time.time() - start
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(BENCH, "bin") + os.pathsep + env.get("PATH", "")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["SH_T_STUB_DELAY"] = str(args.delay)
+    env["SH_T_STUB_RATE"] = str(args.rate)
+    extra = [arg for arg in args.sh_t_args if arg != "--"]
+    cmd = [
+        sys.executable,
+        os.path.join(ROOT, "bin", "sh_t"),
+        "--config", args.config,
+        "--alignments", alignments,
+        "--output", output,
+        "--cores", str(args.cores),
+        "--searches", str(args.searches)
+    ] + extra
+    with open(os.path.join(work, "sh_t.stdout"), "w") as log:
+        start = time.time()
+        returncode = subprocess.call(cmd, cwd=work, env=env, stdout=log, stderr=subprocess.STDOUT)
+        wall = time.time() - start
+    if returncode != 0:
+        raise RuntimeError("sh_t exited with {}, see {}".format(returncode, log.name))
+    conn = sqlite3.connect(os.path.join(output, "sh_test_results.sqlite"))
+    loci = conn.execute("SELECT COUNT(DISTINCT locus) FROM results").fetchone()[0]
+    calls, command_wall = conn.execute("SELECT COUNT(*), SUM(wall) FROM timings").fetchone()
+    conn.close()
+    files, size = count_files(output)
+    return {
+        "version": sh_t.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "loci": args.loci,
+        "taxa": args.taxa,
+        "sites": args.sites,
+        "cores": args.cores,
+        "searches": args.searches,
+        "delay": args.delay,
+        "rate": args.rate,
+        "sh_t_args": " ".join(extra),
+        "generate_seconds": generate,
+        "wall_seconds": wall,
+        "loci_finished": loci,
+        "raxml_calls": calls,
+        "raxml_seconds": command_wall,
+        # share of the cores' time spent inside RAxML
+        "parallel_efficiency": command_wall / (wall * args.cores),
+        "overhead_per_locus_seconds": (wall * args.cores - command_wall) / max(loci, 1),
+        "output_files": files,
+        "output_bytes": size,
+        "files_per_locus": float(files) / max(loci, 1)
+    }
+
+
+def main():
+    args = get_args()
+    work = tempfile.mkdtemp(prefix="sh_t-bench-")
+    try:
+        result = run(args, work)
+    finally:
+        if args.keep:
+            sys.stderr.write("Kept {}\n".format(work))
+        else:
+            shutil.rmtree(work)
+    for key in sorted(result):
+        print "{:<28}{}".format(key, result[key])
+    if args.record is not None:
+        with open(args.record, "a") as outfile:
+            outfile.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == '__main__':
+    main()
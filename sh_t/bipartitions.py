@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 19 October 2026 16:20 PDT (-0700)
+
+Compare the topologies of the trees of every locus as sets of
+bipartitions, each held as an integer bitmask over the taxa of the
+locus.  Newick is tokenized directly, without dendropy, so a run's
+trees can be compared in one pass over the results database.
+"""
+
+
+import re
+
+#import pdb
+
+
+# branch lengths, and a closing parenthesis followed by an inner node
+# label once they are gone
+_length = re.compile(r":[^,();]*")
+_inner_label = re.compile(r"\)[^,)]")
+# a structural character, a quoted label or a bare label, for other trees
+_token = re.compile(r"\[[^\]]*\]|:[^(),;\[]*|([(),])|'([^']*)'|([^(),:;\s'\[]+)")
+
+
+def tokenize(newick):
+    """Reduce a newick string to its parentheses and leaf labels"""
+    if not ("'" in newick or "[" in newick or " " in newick or "\t" in newick or "\n" in newick):
+        # trees like RAxML's split on commas, once each parenthesis is
+        # a token of its own
+        plain = _length.sub("", newick.rstrip(";"))
+        if not _inner_label.search(plain):
+            return plain.replace("(", "(,").replace(")", ",)").split(",")
+    tokens = []
+    previous = "("
+    for punct, quoted, label in _token.findall(newick):
+        if punct:
+            if punct != ",":
+                tokens.append(punct)
+        elif (quoted or label) and previous != ")":
+            # labels after a closing parenthesis belong to inner nodes
+            tokens.append(quoted or label)
+        previous = punct or "label"
+    return tokens
+
+
+def get_labels(taxon_index):
+    """Get the taxa of an index in the order of their bits"""
+    return sorted(taxon_index, key=taxon_index.get)
+
+
+def count_bits(mask):
+    return bin(mask).count("1")
+
+
+def get_splits(tokens, taxon_index):
+    """Get the leaves of a tokenized tree, as a mask, and its non-trivial
+    bipartitions, each named by the side without the lowest taxon so the
+    same split always gets the same mask.  Taxa missing from taxon_index,
+    a dict of {taxon: bit}, are given the next free bit, so trees read
+    with the same index share their bits."""
+    # this loop sees every token of every tree in a run, so methods are
+    # bound once and the open clade is kept out of the stack
+    clusters = []
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    keep = clusters.append
+    current = 0
+    for token in tokens:
+        if token == "(":
+            push(current)
+            current = 0
+        elif token == ")":
+            keep(current)
+            current |= pop()
+        else:
+            try:
+                current |= taxon_index[token]
+            except KeyError:
+                taxon_index[token] = 1 << len(taxon_index)
+                current |= taxon_index[token]
+    leaves = current
+    low = leaves & -leaves
+    splits = set()
+    for cluster in clusters:
+        rest = leaves ^ cluster
+        # each side holds at least two taxa
+        if cluster & (cluster - 1) and rest & (rest - 1):
+            splits.add(rest if cluster & low else cluster)
+    return leaves, frozenset(splits)
+
+
+def restrict(tree, subset):
+    """Prune the (leaves, splits) of a tree to the taxa in subset"""
+    leaves, splits = tree
+    subset &= leaves
+    if subset == leaves:
+        return tree
+    low = subset & -subset
+    pruned = set()
+    for split in splits:
+        split &= subset
+        rest = subset ^ split
+        if split & (split - 1) and rest & (rest - 1):
+            pruned.add(rest if split & low else split)
+    return subset, frozenset(pruned)
+
+
+def rf_distance(first, second):
+    """Get the Robinson-Foulds distance between two (leaves, splits) pairs,
+    over the taxa they share, and the largest it could be"""
+    shared = first[0] & second[0]
+    a = restrict(first, shared)[1]
+    b = restrict(second, shared)[1]
+    return len(a ^ b), 2 * max(count_bits(shared) - 3, 0)
+
+
+def format_splits(splits, labels):
+    return ";".join([format_split(split, labels) for split in splits])
+
+
+def format_split(split, labels):
+    """The taxa on one side of a bipartition, given the labels of the
+    index in bit order"""
+    taxa = []
+    while split:
+        bit = split & -split
+        taxa.append(labels[bit.bit_length() - 1])
+        split ^= bit
+    return ",".join(sorted(taxa))
+
+
+def compare_locus(trees, constraints, taxon_index):
+    """Compare the best tree of a locus, trees["BEST"], with its tree for
+    each constraint, and look for the constrained clades in the best tree.
+
+    trees holds newick strings, and constraints the (leaves, splits) of
+    each constraint read with taxon_index.  Constraints are pruned to the
+    taxa of the locus.  Returns one (tree, ntax, rf, max rf, clades,
+    clades in the best tree, missing clades) row per constraint, where
+    the missing clades are a list of masks, each one side of a
+    bipartition.  The clade columns are None for trees with no
+    constraint."""
+    # constraints without a search of their own reuse another tree
+    parsed = {}
+    for tree_name, newick in trees.items():
+        if newick not in parsed:
+            parsed[newick] = get_splits(tokenize(newick), taxon_index)
+    best = parsed[trees["BEST"]]
+    ntax = count_bits(best[0])
+    rows = []
+    for tree_name in sorted(trees):
+        if tree_name == "BEST":
+            continue
+        rf, max_rf = rf_distance(best, parsed[trees[tree_name]])
+        if tree_name in constraints:
+            leaves, clades = restrict(constraints[tree_name], best[0])
+            present = restrict(best, leaves)[1]
+            missing = sorted(clades - present)
+            rows.append((tree_name, ntax, rf, max_rf, len(clades), len(clades) - len(missing), missing))
+        else:
+            rows.append((tree_name, ntax, rf, max_rf, None, None, None))
+    return rows
+
+
+def compare_loci(loci, constraints):
+    """Compare the trees of each (locus, {tree: newick}) in loci, as
+    compare_locus() does, with constraints given as {name: newick}.
+    Returns one row per constraint of each locus, led by the locus, with
+    the missing clades formatted as taxa separated by commas, and clades
+    by semicolons.  Loci are independent, so lists of them can be
+    compared in separate processes."""
+    # one index of taxa to bits for all the loci, so each constraint is
+    # read once
+    taxon_index = {}
+    constraint_splits = dict([
+        (constraint_name, get_splits(tokenize(newick), taxon_index))
+        for constraint_name, newick in constraints.items()
+    ])
+    rows = []
+    for locus, trees in loci:
+        for row in compare_locus(trees, constraint_splits, taxon_index):
+            rows.append((locus,) + row)
+    labels = get_labels(taxon_index)
+    return [
+        row[:-1] + (None if row[-1] is None else format_splits(row[-1], labels),)
+        for row in rows
+    ]
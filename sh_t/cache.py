@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 11:20 PDT (-0700)
+"""
+
+
+import os
+import errno
+import random
+import shutil
+import hashlib
+import tempfile
+
+#import pdb
+
+
+def get_key(*parts):
+    """Hash the parts of a job's inputs into a cache key"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part))
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+def get_file_key(pth):
+    """Hash the content of a file"""
+    digest = hashlib.sha1()
+    with open(pth, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), ""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_seed(key):
+    """Derive a RAxML seed from a cache key"""
+    return int(key[:8], 16) % 99999999 + 1
+
+
+def read_seed(cache_dir):
+    """Get the run seed stored with the cache, so re-runs hit it by default"""
+    if cache_dir is None:
+        return random.randrange(1, 100000000)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    seed_pth = os.path.join(cache_dir, "seed")
+    if not os.path.isfile(seed_pth):
+        with open(seed_pth, 'w') as outfile:
+            outfile.write("{}\n".format(random.randrange(1, 100000000)))
+    with open(seed_pth) as infile:
+        return int(infile.read().strip())
+
+
+def get_entry(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def has(cache_dir, key, names):
+    """Check for an entry holding all of names"""
+    if cache_dir is None:
+        return False
+    entry = get_entry(cache_dir, key)
+    return all([os.path.isfile(os.path.join(entry, name)) for name in names])
+
+
+def fetch(cache_dir, key, files):
+    """Copy a cached entry out to the paths in files, a dict of
+    {name: destination}.  Returns False when caching is off or the
+    entry is missing."""
+    if cache_dir is None:
+        return False
+    if not has(cache_dir, key, files):
+        return False
+    entry = get_entry(cache_dir, key)
+    for name, pth in files.items():
+        shutil.copyfile(os.path.join(entry, name), pth)
+    return True
+
+
+def store(cache_dir, key, files):
+    """Atomically add files, a dict of {name: source}, to the cache"""
+    if cache_dir is None:
+        return
+    entry = get_entry(cache_dir, key)
+    if os.path.isdir(entry):
+        return
+    parent = os.path.dirname(entry)
+    try:
+        os.makedirs(parent)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    # write to a temp dir first so readers never see a partial entry
+    temp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    for name, pth in files.items():
+        shutil.copyfile(pth, os.path.join(temp, name))
+    try:
+        os.rename(temp, entry)
+    except OSError:
+        # another worker stored the same key first
+        shutil.rmtree(temp)
@@ -12,12 +12,15 @@ Created on 31 January 2014 11:38 PST (-0800)
 """
 
 from __future__ import absolute_import
-#import os
+import os
+import sys
+import socket
 import argparse
 from sh_t import core
+from sh_t import memory
 
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Run constraint tests using RAxML",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -39,7 +42,25 @@ def get_args():
         '--output',
         required=True,
         help='The output directory for results.',
-        action=core.CreateDir
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        default=False,
+        help='Check the config, alignments and constraints, and print the jobs and predicted cost of the run, without running it.',
+    )
+    parser.add_argument(
+        '--scratch',
+        default=None,
+        help='A local or tmpfs directory for RAxML working files.  Finished loci are moved (or packed) to --output.',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--pack',
+        choices=['tar', 'db'],
+        default=None,
+        help='Pack the files of each finished locus into <locus>.tar.gz, or into the results database.',
     )
     parser.add_argument(
         '--cores',
@@ -47,16 +68,189 @@ def get_args():
         default=1,
         help='The number of compute cores to use.',
     )
+    parser.add_argument(
+        '--patterns-per-thread',
+        type=int,
+        default=1000,
+        help='Alignment columns (site patterns with --compress) per RAxML thread.  Loci with enough columns run on the PTHREADS RAxML build, within --cores.',
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=memory.parse_memory,
+        default=None,
+        help='A memory budget (e.g. 512M, 16G) for the RAxML jobs running at once.',
+    )
+    parser.add_argument(
+        '--runner',
+        choices=['processes', 'threads'],
+        default='processes',
+        help='Drive RAxML jobs from a pool of processes or of threads in one process.',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=None,
+        help='Seconds each RAxML command may run before it is killed and its job fails.',
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=2,
+        help='The times to re-run a failed job, with a new seed, before giving up on its locus.',
+    )
+    parser.add_argument(
+        '--speculate',
+        type=float,
+        default=None,
+        help='When no job is waiting, start a second copy of any job running this many times longer than predicted, and keep the first to finish.',
+    )
     parser.add_argument(
         '--searches',
         type=int,
         default=20,
         help='The number of RAxML search reps to use.',
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        default=False,
+        help='Run search reps in batches until the best likelihood stops improving, instead of --searches reps.',
+    )
+    parser.add_argument(
+        '--batch-searches',
+        type=int,
+        default=4,
+        help='The number of search reps in each batch of an --adaptive search.',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.1,
+        help='The log-likelihood gain below which an --adaptive batch does not count as an improvement.',
+    )
+    parser.add_argument(
+        '--patience',
+        type=int,
+        default=2,
+        help='Stop an --adaptive search after this many batches without improvement.',
+    )
+    parser.add_argument(
+        '--max-searches',
+        type=int,
+        default=100,
+        help='The most search reps an --adaptive search may run.',
+    )
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='Split the search reps of each search across this many concurrent RAxML runs.',
+    )
+    parser.add_argument(
+        '--compress',
+        action='store_true',
+        default=False,
+        help='Drop taxa and columns without data and collapse repeated site patterns before running RAxML.',
+    )
+    parser.add_argument(
+        '--replicates',
+        type=int,
+        default=1000,
+        help='The number of RELL bootstrap replicates used by the SH, KH, AU and ELW tests.',
+    )
+    parser.add_argument(
+        '--site-ll-dtype',
+        choices=['float64', 'float32'],
+        default='float64',
+        help='The precision of the binary store of per-site log-likelihoods.',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='The seed used to derive RAxML search seeds (default: stored with the cache, else random).',
+    )
+    parser.add_argument(
+        '--cache',
+        default=None,
+        help='A directory of cached results, shared between runs, used to skip finished searches (default: <output>.cache).',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--reuse-model',
+        action='store_true',
+        default=False,
+        help='Reuse GTRGAMMA parameters from the best-ML tree in constrained searches and tests.',
+    )
+    parser.add_argument(
+        '--history',
+        nargs='+',
+        default=None,
+        help='Results databases from earlier runs, used to learn job run times.',
+        action=core.FullPaths
+    )
+    args = parser.parse_args(argv)
+    # --output is replaced on each run, so the cache that lets a run
+    # resume lives beside it
+    if args.cache is None:
+        args.cache = args.output.rstrip(os.sep) + ".cache"
+    elif args.cache == args.output or args.cache.startswith(args.output.rstrip(os.sep) + os.sep):
+        parser.error("--cache can't be inside --output, which is removed when a run starts")
+    return args
+
+
+def get_work_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="sh_t work",
+        description="Run jobs queued by `sh_t plan`.  Start any number of workers, on any hosts sharing --output.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--output',
+        required=True,
+        help='The output directory of the planned run.',
+        action=core.FullPaths,
+        type=core.is_dir
+    )
+    parser.add_argument(
+        '--worker',
+        default="{}.{}".format(socket.gethostname(), os.getpid()),
+        help='A name for this worker, unique across hosts.',
+    )
+    parser.add_argument(
+        '--lease',
+        type=float,
+        default=300.,
+        help='Seconds a claimed job stays ours without a heartbeat.  Heartbeats renew it every third of this.',
+    )
+    parser.add_argument(
+        '--poll',
+        type=float,
+        default=5.,
+        help='Seconds to wait between checks when no job is ready.',
+    )
+    return parser.parse_args(argv)
 
 
 def main():
-    from curb.main import main
-    args = get_args()
-    main(args)
+    """`sh_t <options>` runs on this host; `sh_t plan <options>` queues
+    the run in --output for `sh_t work` processes"""
+    if len(sys.argv) > 1 and sys.argv[1] == "work":
+        args = get_work_args(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "plan":
+        args = get_args(sys.argv[2:])
+    else:
+        args = get_args()
+    # import the pipeline once the arguments are good, so --help and
+    # argument errors come back fast
+    from sh_t import main as sh_t_main
+    if len(sys.argv) > 1 and sys.argv[1] == "work":
+        sh_t_main.work(args)
+    elif args.dry_run:
+        return sh_t_main.dry_run(args)
+    elif len(sys.argv) > 1 and sys.argv[1] == "plan":
+        core.create_dir(args.output)
+        sh_t_main.plan(args)
+    else:
+        core.create_dir(args.output)
+        sh_t_main.main(args)
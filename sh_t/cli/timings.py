@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 17:40 PDT (-0700)
+"""
+
+from __future__ import absolute_import
+import argparse
+import sqlite3
+from sh_t import core
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Summarize RAxML run times and memory use from a results database",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '--db',
+        required=True,
+        help='Path to sh_test_results.sqlite.',
+        action=core.FullPaths
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=10,
+        help='The number of loci and commands to list.',
+    )
+    return parser.parse_args()
+
+
+def print_table(header, rows, formats):
+    print "  ".join(["{:>12}".format(h) for h in header])
+    for row in rows:
+        print "  ".join([fmt.format(value) for fmt, value in zip(formats, row)])
+    print ""
+
+
+def summarize(conn, top=10):
+    print "Stages"
+    print_table(
+        ("stage", "calls", "wall(s)", "mean(s)", "max(s)", "cpu(s)", "maxrss(MB)", "failed"),
+        conn.execute("""SELECT stage, COUNT(*), SUM(wall), AVG(wall), MAX(wall),
+            SUM(user + sys), MAX(maxrss_kb) / 1024.0, SUM(returncode != 0)
+            FROM timings GROUP BY stage ORDER BY SUM(wall) DESC""").fetchall(),
+        ("{:>12}", "{:>12}", "{:>12.1f}", "{:>12.1f}", "{:>12.1f}", "{:>12.1f}", "{:>12.1f}", "{:>12}")
+    )
+    print "Slowest loci"
+    print_table(
+        ("locus", "calls", "wall(s)", "cpu(s)", "maxrss(MB)"),
+        conn.execute("""SELECT locus, COUNT(*), SUM(wall), SUM(user + sys),
+            MAX(maxrss_kb) / 1024.0 FROM timings GROUP BY locus
+            ORDER BY SUM(wall) DESC LIMIT ?""", (top,)).fetchall(),
+        ("{:>12}", "{:>12}", "{:>12.1f}", "{:>12.1f}", "{:>12.1f}")
+    )
+    print "Slowest commands"
+    print_table(
+        ("locus", "stage", "tree", "wall(s)", "cpu(s)", "maxrss(MB)"),
+        conn.execute("""SELECT locus, stage, COALESCE(tree, ''), wall, user + sys,
+            maxrss_kb / 1024.0 FROM timings ORDER BY wall DESC LIMIT ?""", (top,)).fetchall(),
+        ("{:>12}", "{:>12}", "{:>12}", "{:>12.1f}", "{:>12.1f}", "{:>12.1f}")
+    )
+
+
+def main():
+    args = get_args()
+    conn = sqlite3.connect(args.db)
+    try:
+        summarize(conn, args.top)
+    finally:
+        conn.close()
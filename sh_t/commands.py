@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 16:58 PDT (-0700)
+"""
+
+
+import os
+import time
+import signal
+import tempfile
+import threading
+import subprocess
+
+#import pdb
+
+
+# resource use of the external commands run by each thread since its
+# last call to drain()
+_local = threading.local()
+
+
+def get_records():
+    if not hasattr(_local, "records"):
+        _local.records = []
+    return _local.records
+
+
+def set_timeout(timeout):
+    """Kill the commands this thread runs after timeout seconds (None for
+    no limit)"""
+    _local.timeout = timeout
+
+
+def get_timeout():
+    return getattr(_local, "timeout", None)
+
+
+class CommandError(Exception):
+    def __init__(self, message, record, output):
+        Exception.__init__(self, message)
+        self.record = record
+        self.output = output
+
+
+class CommandRecord(object):
+    """Wall time and resource use of one external command"""
+    def __init__(self, locus, stage, constraint, wall, user, sys, maxrss_kb, returncode, timed_out=False):
+        self.locus = locus
+        self.stage = stage
+        self.constraint = constraint
+        self.wall = wall
+        self.user = user
+        self.sys = sys
+        self.maxrss_kb = maxrss_kb
+        self.returncode = returncode
+        self.timed_out = timed_out
+
+
+def run(cmd, stage, locus=None, constraint=None, cwd=None):
+    """Run cmd to completion in cwd, recording its wall time, CPU time,
+    peak RSS and exit code.  Returns the record and the command's output.
+    The command is killed if it outlives the timeout of this thread.
+    Nothing here touches process-wide state, so jobs may run on threads."""
+    # output goes to a file rather than a pipe so we can reap the child
+    # with wait4, which gives the resource use of this child alone
+    with tempfile.TemporaryFile() as output:
+        start = time.time()
+        proc = subprocess.Popen(
+            cmd,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            close_fds=True
+        )
+        timeout = get_timeout()
+        killed = []
+        if timeout is not None:
+            def kill():
+                killed.append(True)
+                os.kill(proc.pid, signal.SIGKILL)
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            pid, status, rusage = os.wait4(proc.pid, 0)
+        finally:
+            if timeout is not None:
+                timer.cancel()
+        wall = time.time() - start
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        proc.returncode = returncode
+        output.seek(0)
+        stdout = output.read()
+    record = CommandRecord(
+        locus,
+        stage,
+        constraint,
+        wall,
+        rusage.ru_utime,
+        rusage.ru_stime,
+        rusage.ru_maxrss,
+        returncode,
+        bool(killed)
+    )
+    get_records().append(record)
+    return record, stdout
+
+
+def check(cmd, stage, locus=None, constraint=None, cwd=None):
+    """Run cmd as run() does, raising CommandError if it times out or
+    exits with an error"""
+    record, stdout = run(cmd, stage, locus, constraint, cwd)
+    if record.timed_out:
+        message = "{} timed out after {:.0f} seconds".format(cmd[0], record.wall)
+    elif record.returncode != 0:
+        message = "{} exited with status {}".format(cmd[0], record.returncode)
+    else:
+        return record, stdout
+    # the end of the output usually says what went wrong
+    tail = "\n".join(stdout.strip().splitlines()[-10:])
+    raise CommandError("{}:\n{}".format(message, tail), record, stdout)
+
+
+def drain():
+    """Return, and forget, the records of commands this thread has run"""
+    records = list(get_records())
+    del get_records()[:]
+    return records
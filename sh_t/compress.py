@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 22:05 PDT (-0700)
+
+Shrink alignments before inference.  Taxa with no data and columns with
+no data are dropped, and repeated site patterns are collapsed into one
+weighted column, keeping a map from each original site to its pattern.
+"""
+
+
+import os
+
+# numpy is only imported by the functions that read and compress
+# alignments
+
+from sh_t import core
+
+#import pdb
+
+
+# characters RAxML treats as entirely undetermined for DNA data
+MISSING = "-?NX"
+
+
+_compressed_alignments = {}
+
+
+def read_phylip(alignment):
+    """Read a sequential or interleaved relaxed PHYLIP file into a list of
+    taxa and a taxa x sites array of upper-case characters"""
+    import numpy
+    with open(alignment, 'rU') as infile:
+        ntax, nchar, taxa = core.read_phylip_names(infile)
+    with open(alignment, 'rU') as infile:
+        lines = [line.strip() for line in infile if line.strip()][1:]
+    seqs = [[] for taxon in taxa]
+    for cnt, line in enumerate(lines):
+        if cnt < ntax:
+            # the first block follows each name
+            line = line.split(None, 1)[1] if len(line.split(None, 1)) > 1 else ""
+        seqs[cnt % ntax].append("".join(line.split()))
+    seqs = ["".join(seq).upper() for seq in seqs]
+    for taxon, seq in zip(taxa, seqs):
+        if len(seq) != nchar:
+            raise ValueError("{} has {} of {} sites in {}".format(taxon, len(seq), nchar, alignment))
+    matrix = numpy.array([list(seq) for seq in seqs], dtype="S1").reshape(ntax, nchar)
+    return taxa, matrix
+
+
+def write_phylip(pth, taxa, matrix):
+    width = max([len(taxon) for taxon in taxa]) + 1
+    with open(pth, 'w') as outfile:
+        outfile.write("{} {}\n".format(*matrix.shape))
+        for taxon, row in zip(taxa, matrix):
+            outfile.write("{}{}\n".format(taxon.ljust(width), row.tostring()))
+
+
+def compress_alignment(taxa, matrix):
+    """Drop taxa and columns holding only missing data and collapse the
+    remaining columns to unique patterns, in order of first appearance.
+
+    Returns (kept taxa, dropped taxa, taxa x patterns array, pattern
+    weights, site map) where the site map gives the pattern of each
+    original column, or -1 for dropped columns."""
+    import numpy
+    missing = numpy.in1d(matrix.ravel(), list(MISSING)).reshape(matrix.shape)
+    # all missing-data characters are equivalent to RAxML
+    matrix = numpy.where(missing, "-", matrix)
+    has_data = ~missing.all(axis=1)
+    kept = matrix[has_data]
+    columns = ~missing[has_data].all(axis=0)
+    site_map = numpy.repeat(-1, matrix.shape[1])
+    if not columns.any():
+        patterns = kept[:, :0]
+        weights = numpy.zeros(0, dtype=numpy.int64)
+    else:
+        kept = numpy.ascontiguousarray(kept[:, columns].T)
+        # compare whole columns as single values
+        rows = kept.view(numpy.dtype((numpy.void, kept.shape[1]))).ravel()
+        uniques, first, inverse, weights = numpy.unique(
+            rows,
+            return_index=True,
+            return_inverse=True,
+            return_counts=True
+        )
+        order = numpy.argsort(first)
+        rank = numpy.empty_like(order)
+        rank[order] = numpy.arange(len(order))
+        patterns = kept[first[order]].T
+        weights = weights[order]
+        site_map[columns] = rank[inverse]
+    kept_taxa = [taxon for taxon, ok in zip(taxa, has_data) if ok]
+    dropped_taxa = [taxon for taxon, ok in zip(taxa, has_data) if not ok]
+    return kept_taxa, dropped_taxa, patterns, weights, site_map
+
+
+def get_memo_key(alignment):
+    stat = os.stat(alignment)
+    return (os.path.abspath(alignment), stat.st_mtime, stat.st_size)
+
+
+def get_compressed_alignment(alignment):
+    """Compress an alignment, memoized on (path, mtime, size) like
+    core.scan_alignment, until forget_compressed_alignment() is called"""
+    memo_key = get_memo_key(alignment)
+    if memo_key not in _compressed_alignments:
+        _compressed_alignments[memo_key] = compress_alignment(*read_phylip(alignment))
+    return _compressed_alignments[memo_key]
+
+
+def count_patterns(alignment):
+    """Count the distinct site patterns RAxML would see in an alignment,
+    without keeping the alignment in memory"""
+    return len(compress_alignment(*read_phylip(alignment))[3])
+
+
+def forget_compressed_alignment(alignment):
+    """Drop a compressed alignment from the memo, once it is staged or
+    won't be used"""
+    _compressed_alignments.pop(get_memo_key(alignment), None)
+
+
+def get_taxa_with_data(alignment):
+    return frozenset(get_compressed_alignment(alignment)[0])
+
+
+def stage_compressed_alignment(alignment, working_dir, orig_aln_name):
+    """Write the compressed alignment, its column weights for RAxML -a,
+    and the site map to the working dir.  Returns the paths to the
+    alignment and to a (weights, site map) pair.  The staged files stand
+    in for the compressed alignment from then on, so it isn't kept."""
+    import numpy
+    taxa, dropped_taxa, patterns, weights, site_map = get_compressed_alignment(alignment)
+    forget_compressed_alignment(alignment)
+    working_alignment = os.path.join(working_dir, "{}.compressed.phylip".format(orig_aln_name))
+    write_phylip(working_alignment, taxa, patterns)
+    weights_pth = os.path.join(working_dir, "{}.weights".format(orig_aln_name))
+    with open(weights_pth, 'w') as outfile:
+        outfile.write(" ".join([str(weight) for weight in weights]) + "\n")
+    site_map_pth = os.path.join(working_dir, "{}.sites.npy".format(orig_aln_name))
+    numpy.save(site_map_pth, site_map)
+    return working_alignment, (weights_pth, site_map_pth)
+
+
+def expand_site_lls(site_lls, site_map_pth):
+    """Map trees x patterns site log-likelihoods back to the original
+    columns.  Columns with no data have a likelihood of 1 under every
+    tree, so they get a log-likelihood of 0."""
+    import numpy
+    site_map = numpy.load(site_map_pth)
+    expanded = numpy.zeros((site_lls.shape[0], len(site_map)), dtype=site_lls.dtype)
+    kept = site_map >= 0
+    expanded[:, kept] = site_lls[:, site_map[kept]]
+    return expanded
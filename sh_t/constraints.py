@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 13:05 PDT (-0700)
+"""
+
+
+import re
+import threading
+import collections
+
+#import pdb
+
+
+class LRUCache(object):
+    """A small, thread-safe, least-recently-used mapping"""
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+
+# parsed trees and their taxa, keyed on (name, newick).  these are filled
+# in the parent before the pool forks, so workers inherit them.
+_constraint_trees = {}
+_pruned_constraints = LRUCache()
+_prune_lock = threading.Lock()
+
+
+def load_constraint_trees(constraints):
+    """Parse every constraint newick once"""
+    for constraint in constraints.items():
+        get_constraint_tree(constraint)
+
+
+def get_constraint_tree(constraint):
+    """Return the parsed tree and its taxa for a (name, newick) constraint"""
+    if constraint not in _constraint_trees:
+        # dendropy is slow to import, and only needed to run searches
+        import dendropy
+        constraint_name, constraint_string = constraint
+        tree = dendropy.Tree.get_from_string(
+            constraint_string,
+            schema="newick",
+            preserve_underscores=True
+        )
+        taxa = frozenset([leaf.taxon.label for leaf in tree.leaf_node_iter()])
+        _constraint_trees[constraint] = (tree, taxa)
+    return _constraint_trees[constraint]
+
+
+def get_newick_taxa(newick):
+    """Get the taxa of a constraint newick without parsing the tree, for
+    checks that don't need dendropy"""
+    newick = re.sub(r"\[[^\]]*\]", "", newick)
+    taxa = set()
+    # labels after a closing parenthesis belong to inner nodes
+    for before, quoted, label in re.findall(r"([(,)])\s*(?:'([^']*)'|([^(),:;\s']+))", newick):
+        if before != ")":
+            taxa.add(quoted or label)
+    return frozenset(taxa)
+
+
+def get_splits(tree, taxa):
+    """Return the non-trivial bipartitions of a tree over taxa, each given
+    as the side that does not hold the first taxon"""
+    if not taxa:
+        return frozenset()
+    anchor = min(taxa)
+    splits = set()
+    below = {}
+    for node in tree.postorder_node_iter():
+        if node.is_leaf():
+            below[node] = frozenset([node.taxon.label])
+        else:
+            below[node] = frozenset().union(*[below[child] for child in node.child_node_iter()])
+            if 1 < len(below[node]) < len(taxa) - 1:
+                if anchor in below[node]:
+                    splits.add(taxa - below[node])
+                else:
+                    splits.add(below[node])
+    return frozenset(splits)
+
+
+def format_splits(taxa, splits):
+    """A canonical string for a set of splits over taxa.  The taxa are
+    part of it because a taxon outside every split is free to go anywhere
+    in the tree, which only a constraint without it allows."""
+    return "{}|{}".format(
+        ",".join(sorted(taxa)),
+        ";".join(sorted([",".join(sorted(split)) for split in splits]))
+    )
+
+
+def prune_constraint(constraint, alignment_taxa):
+    """Prune a constraint to the alignment taxa, returning the newick with
+    branch lengths set to 1, the taxa it keeps and its splits.  Loci
+    sharing a taxon set share the result."""
+    tree, constraint_taxa = get_constraint_tree(constraint)
+    # find which taxa are present
+    intersect = constraint_taxa.intersection(alignment_taxa)
+    key = (constraint, intersect)
+    pruned_constraint = _pruned_constraints.get(key)
+    if pruned_constraint is None:
+        # clones share the parsed tree's taxon namespace, so prune one
+        # at a time when jobs run on threads
+        with _prune_lock:
+            pruned = tree.clone(depth=1)
+            # prune constraint tree to remove missing taxa
+            pruned.retain_taxa_with_labels(intersect)
+            # set_branch_lengths_equal
+            for edge in pruned.preorder_edge_iter():
+                if edge.length:
+                    edge.length = 1.0
+            pruned_constraint = (pruned.as_string(schema="newick"), intersect, get_splits(pruned, intersect))
+        _pruned_constraints.put(key, pruned_constraint)
+    return pruned_constraint
+
+
+def get_pruned_constraint(constraint, alignment_taxa):
+    """Return the pruned, normalized constraint newick"""
+    return prune_constraint(constraint, alignment_taxa)[0]
+
+
+def get_distinct_constraints(constraints, alignment_taxa):
+    """Group constraints that place the same bipartitions on a locus.
+
+    Constraints only share a search when they keep the same taxa as well
+    as the same bipartitions.  Returns a list of (constraint name,
+    searched as) pairs where `searched as` names the constraint whose
+    search stands in for this one, or is None when the pruned constraint
+    is a star tree that constrains nothing, and a dict of {searched as:
+    splits}."""
+    constraint_map = []
+    searches = {}
+    seen = {}
+    for constraint in sorted(constraints.items()):
+        newick, taxa, splits = prune_constraint(constraint, alignment_taxa)
+        if not splits:
+            constraint_map.append((constraint[0], None))
+        elif (taxa, splits) in seen:
+            constraint_map.append((constraint[0], seen[(taxa, splits)]))
+        else:
+            seen[(taxa, splits)] = constraint[0]
+            searches[constraint[0]] = splits
+            constraint_map.append((constraint[0], constraint[0]))
+    return constraint_map, searches
@@ -13,39 +13,41 @@ Created on 21 April 2014 20:54 PDT (-0700)
 
 
 import os
+import re
 import sys
 import glob
+import mmap
 import shutil
 import argparse
 import subprocess
 
-from Bio import AlignIO
-
-import pdb
+#import pdb
 
 
 class FullPaths(argparse.Action):
     """Expand user- and relative-paths"""
     def __call__(self, parser, namespace, values, option_string=None):
-        setattr(namespace, self.dest, os.path.abspath(os.path.expanduser(values)))
+        if isinstance(values, list):
+            values = [os.path.abspath(os.path.expanduser(value)) for value in values]
+        else:
+            values = os.path.abspath(os.path.expanduser(values))
+        setattr(namespace, self.dest, values)
 
 
-class CreateDir(argparse.Action):
-    def __call__(self, parser, namespace, values, option_string=None):
-        # get the full path
-        d = os.path.abspath(os.path.expanduser(values))
-        # check to see if directory exists
-        if os.path.exists(d):
-            answer = raw_input("[WARNING] Output directory exists, REMOVE [Y/n]? ")
-            if answer == "Y":
-                shutil.rmtree(d)
-            else:
-                print "[QUIT]"
-                sys.exit()
-        # create the new directory
-        os.makedirs(d)
-        # return the full path
-        setattr(namespace, self.dest, d)
+def create_dir(d):
+    """Create a fresh output directory, asking before removing one that
+    exists.  Called once arguments are parsed, so --dry-run never makes
+    the directory."""
+    # check to see if directory exists
+    if os.path.exists(d):
+        answer = raw_input("[WARNING] Output directory exists, REMOVE [Y/n]? ")
+        if answer == "Y":
+            shutil.rmtree(d)
+        else:
+            print "[QUIT]"
+            sys.exit()
+    # create the new directory
+    os.makedirs(d)
 
 
 class GroupError(Exception):
@@ -87,6 +89,80 @@ def which(prog):
         return stdout.strip()
 
 
+# RAxML vector builds in order of preference, with the cpu flag each needs
+RAXML_BUILDS = [("-AVX2", "avx2"), ("-AVX", "avx"), ("-SSE3", "pni"), ("", None)]
+
+
+def find_program(prog):
+    """Get the full path to prog on $PATH, or None"""
+    for pth in os.environ.get("PATH", "").split(os.pathsep):
+        candidate = os.path.join(pth, prog)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def get_cpu_flags():
+    """Get the instruction set flags of the cpu, or None where
+    /proc/cpuinfo isn't available"""
+    try:
+        with open("/proc/cpuinfo") as infile:
+            for line in infile:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except IOError:
+        pass
+    return None
+
+
+def find_raxml_builds():
+    """Find the fastest serial and PTHREADS RAxML builds the cpu can run.
+
+    Returns a dict with the path to the "serial" build and to the
+    "pthreads" build, or None when there is no PTHREADS build.  Without
+    cpu flags, only SSE3 and generic builds are trusted."""
+    flags = get_cpu_flags()
+    builds = {"serial": None, "pthreads": None}
+    for suffix, flag in RAXML_BUILDS:
+        if flag is not None and (flags or set(["pni"])).isdisjoint([flag]):
+            continue
+        if builds["serial"] is None:
+            builds["serial"] = find_program("raxmlHPC" + suffix)
+        if builds["pthreads"] is None:
+            builds["pthreads"] = find_program("raxmlHPC-PTHREADS" + suffix)
+    if builds["serial"] is None:
+        raise EnvironmentError("Program raxmlHPC-SSE3 (or another RAxML build) does not appear to be installed")
+    return builds
+
+
+def link_or_copy(src, dst):
+    """Stage a file by hard link, falling back to a symlink across
+    filesystems and to a copy where links aren't supported"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+
+def get_raxml_version(raxml):
+    proc = subprocess.Popen(
+        [raxml, "-v"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stdout, stderr = proc.communicate()
+    match = re.search("version\s+(\S+)", stdout)
+    if match:
+        return match.groups()[0]
+    else:
+        return stdout.strip()
+
+
 def get_alignments(alignment_dir):
     alignments = []
     for ftype in ('.phylip', '.phy'):
@@ -107,26 +183,95 @@ def satisfy_one_taxon_group(taxa_in_align, taxon_group):
         return False
 
 
+_scanned_alignments = {}
+
+
+def read_phylip_names(infile):
+    """Read the header and taxon names from a relaxed PHYLIP file object
+    (or mmap), without parsing the sequences"""
+    header = infile.readline()
+    while header and not header.strip():
+        header = infile.readline()
+    try:
+        ntax, nchar = [int(i) for i in header.split()[:2]]
+    except ValueError:
+        raise ValueError("Bad PHYLIP header: {}".format(header.strip()))
+    taxa = []
+    # interleaved files only name taxa in the first block, so the first
+    # ntax lines always hold the names
+    while len(taxa) < ntax:
+        line = infile.readline()
+        if not line:
+            raise ValueError("Found {} of {} taxa".format(len(taxa), ntax))
+        if line.strip():
+            taxa.append(line.split(None, 1)[0])
+    return ntax, nchar, taxa
+
+
+def scan_alignment(alignment):
+    """Return (ntax, nchar, frozenset of taxa) for a PHYLIP alignment.
+
+    Results are memoized on (path, mtime, size) so filtering and job
+    setup share one read of each file."""
+    stat = os.stat(alignment)
+    memo_key = (os.path.abspath(alignment), stat.st_mtime, stat.st_size)
+    if memo_key in _scanned_alignments:
+        return _scanned_alignments[memo_key]
+    with open(alignment, 'rb') as infile:
+        try:
+            data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            # empty files and some filesystems can't be mapped
+            data = infile
+        try:
+            ntax, nchar, taxa = read_phylip_names(data)
+        finally:
+            if data is not infile:
+                data.close()
+    result = (ntax, nchar, frozenset(taxa))
+    _scanned_alignments[memo_key] = result
+    return result
+
+
 def get_taxa_in_alignment(alignment):
-    aln = AlignIO.read(alignment, "phylip-relaxed")
-    taxa_in_align = set([taxon.id for taxon in aln])
-    return taxa_in_align
+    return scan_alignment(alignment)[2]
+
+
+def get_taxon_group_coverage(alignments, taxon_groups, get_taxa=get_taxa_in_alignment):
+    """Check every taxon group against every alignment at once.
+
+    Returns the group names and a boolean array with one row per
+    alignment and one column per group, True where the alignment holds
+    at least one member of the group.  get_taxa returns the taxa of an
+    alignment."""
+    import numpy
+    group_names = sorted(taxon_groups.keys())
+    # index only taxa that belong to a group
+    taxon_index = {}
+    for group_name in group_names:
+        for taxon in taxon_groups[group_name]:
+            taxon_index.setdefault(taxon, len(taxon_index))
+    membership = numpy.zeros((len(taxon_index), len(group_names)), dtype=numpy.int32)
+    for col, group_name in enumerate(group_names):
+        for taxon in taxon_groups[group_name]:
+            membership[taxon_index[taxon], col] = 1
+    present = numpy.zeros((len(alignments), len(taxon_index)), dtype=numpy.int32)
+    for row, alignment in enumerate(alignments):
+        cols = [taxon_index[taxon] for taxon in get_taxa(alignment) if taxon in taxon_index]
+        present[row, cols] = 1
+    coverage = numpy.dot(present, membership) > 0
+    return group_names, coverage
 
 
 def satisfy_all_taxon_groups(alignment, taxon_groups):
     """given an input alignment, see if any taxa in list are in file"""
-    taxa_in_align = get_taxa_in_alignment(alignment)
-    taxa_present = []
-    for group_name, taxon_group in taxon_groups.iteritems():
-        if satisfy_one_taxon_group(taxa_in_align, taxon_group):
-            taxa_present.append(True)
-        else:
-            taxa_present.append(False)
-    if all(taxa_present):
+    group_names, coverage = get_taxon_group_coverage([alignment], taxon_groups)
+    if coverage.all():
         return True
     else:
+        missing = [name for name, ok in zip(group_names, coverage[0]) if not ok]
         raise GroupError(
             "Not all taxa present in Group",
-            group_name,
+            ", ".join(missing),
             os.path.basename(alignment),
         )
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 15:47 PDT (-0700)
+"""
+
+
+import heapq
+import sqlite3
+
+from sh_t.scheduler import get_priorities, get_dependents
+
+#import pdb
+
+
+# seconds per unit of work, where a unit is one taxon x site for one search
+# replicate (searches) or one tree (SH test and site likelihoods).  These
+# are replaced by rates learned from earlier runs when they are available.
+DEFAULT_RATES = {
+    "BEST": 3e-5,
+    "CONSTRAINT": 3e-5,
+    "SHTEST": 2e-5
+}
+
+
+def load_rates(databases, min_wall=1.0):
+    """Learn seconds per unit for each stage from the job_timings tables
+    of earlier runs.  Jobs under min_wall seconds (mostly cache hits) are
+    skipped."""
+    rates = dict(DEFAULT_RATES)
+    totals = {}
+    for db_pth in databases or []:
+        conn = sqlite3.connect(db_pth)
+        try:
+            # rates are per thread, so threaded jobs count for their
+            # thread-seconds
+            rows = conn.execute("""SELECT stage, SUM(wall * threads), SUM(units) FROM job_timings
+                WHERE units > 0 AND wall >= ? GROUP BY stage""", (min_wall,)).fetchall()
+        except sqlite3.OperationalError:
+            # no job timings in this database
+            rows = []
+        finally:
+            conn.close()
+        for stage, wall, units in rows:
+            stage_wall, stage_units = totals.get(stage, (0., 0.))
+            totals[stage] = (stage_wall + wall, stage_units + units)
+    for stage, (wall, units) in totals.items():
+        if units > 0:
+            rates[stage] = wall / units
+    return rates
+
+
+def set_job_costs(jobs, rates):
+    """Set the predicted run time of each job from its size, assuming its
+    threads split the work evenly"""
+    for job in jobs:
+        job.cost = job.units * rates.get(job.stage, 0.) / job.threads
+    return jobs
+
+
+def estimate_makespan(jobs, cores):
+    """Predict the wall time of a run by replaying the scheduler's
+    longest-chain-first policy over the job graph with predicted costs"""
+    priorities = get_priorities(jobs)
+    dependents = get_dependents(jobs)
+    by_name = dict([(job.name, job) for job in jobs])
+    waiting_on = dict([(job.name, len(job.depends)) for job in jobs])
+    order = dict([(job.name, cnt) for cnt, job in enumerate(jobs)])
+    ready = [(-priorities[job.name], order[job.name], job.name) for job in jobs if not job.depends]
+    heapq.heapify(ready)
+    running = []
+    threads = 0
+    now = 0.
+    while ready or running:
+        # start jobs in priority order, skipping those without enough free
+        # threads, as the scheduler does
+        skipped = []
+        while ready:
+            job = by_name[heapq.heappop(ready)[2]]
+            if running and threads + job.threads > cores:
+                skipped.append((-priorities[job.name], order[job.name], job.name))
+                continue
+            heapq.heappush(running, (now + job.cost, job.name))
+            threads += job.threads
+        for item in skipped:
+            heapq.heappush(ready, item)
+        now, name = heapq.heappop(running)
+        threads -= by_name[name].threads
+        for child in dependents[name]:
+            waiting_on[child] -= 1
+            if not waiting_on[child]:
+                heapq.heappush(ready, (-priorities[child], order[child], child))
+    return now
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 10:02 PDT (-0700)
+"""
+
+
+import os
+import sys
+import sqlite3
+
+#import pdb
+
+
+def create_results_database(args, log):
+    """Create the results database.
+
+    The database is opened in WAL mode so rows committed as each locus
+    finishes can be read while the run is still going.
+    """
+    log.info("Creating the SH-test results database")
+    db_pth = os.path.join(args.output, "sh_test_results.sqlite")
+    conn = sqlite3.connect(db_pth)
+    c = conn.cursor()
+    c.execute("PRAGMA foreign_keys = ON")
+    c.execute("PRAGMA journal_mode = WAL")
+    c.execute("PRAGMA synchronous = NORMAL")
+    try:
+        query = """CREATE TABLE results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            tree text,
+            ll float,
+            ll_delta float,
+            sd float,
+            worse_five text,
+            worse_two text,
+            worse_one text,
+            sh_p float,
+            kh_p float,
+            au_p float,
+            elw float
+            )
+            """
+        c.execute(query)
+        c.execute("CREATE INDEX results_locus ON results (locus)")
+        # which search produced each constrained tree, after constraints
+        # that collapse to the same bipartitions were merged
+        query = """CREATE TABLE constraint_searches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            tree text,
+            searched_as text
+            )
+            """
+        c.execute(query)
+        # the search replicates behind each best tree
+        query = """CREATE TABLE searches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            tree text,
+            replicates integer
+            )
+            """
+        c.execute(query)
+        # run time of each job, used to predict job costs in later runs
+        query = """CREATE TABLE job_timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            job text,
+            stage text,
+            units float,
+            predicted float,
+            wall float,
+            footprint float,
+            predicted_memory float,
+            threads integer
+            )
+            """
+        c.execute(query)
+        # where each tree's site likelihoods sit in the binary store
+        query = """CREATE TABLE site_lls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            tree text,
+            offset integer,
+            nsites integer
+            )
+            """
+        c.execute(query)
+        c.execute("CREATE INDEX site_lls_locus ON site_lls (locus)")
+        query = """CREATE TABLE site_ll_store (
+            pth text,
+            dtype text
+            )
+            """
+        c.execute(query)
+        # the files of each finished locus, with --pack db
+        query = """CREATE TABLE artifacts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            name text,
+            data blob
+            )
+            """
+        c.execute(query)
+        c.execute("CREATE INDEX artifacts_locus ON artifacts (locus)")
+        # wall time and resource use of each external command
+        query = """CREATE TABLE timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            job text,
+            stage text,
+            tree text,
+            wall float,
+            user float,
+            sys float,
+            maxrss_kb integer,
+            returncode integer
+            )
+            """
+        c.execute(query)
+        # the newick of each constraint, and of the best and constrained
+        # trees of each locus
+        query = """CREATE TABLE constraints (
+            name text PRIMARY KEY,
+            newick text
+            )
+            """
+        c.execute(query)
+        query = """CREATE TABLE trees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            tree text,
+            newick text
+            )
+            """
+        c.execute(query)
+        c.execute("CREATE INDEX trees_locus ON trees (locus)")
+        # the topology of each constrained tree against the best tree, and
+        # the constrained clades found in the best tree
+        query = """CREATE TABLE tree_comparisons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            tree text,
+            ntax integer,
+            rf integer,
+            max_rf integer,
+            clades integer,
+            clades_in_best integer,
+            missing_clades text
+            )
+            """
+        c.execute(query)
+        # queue workers may compare the same locus, so rows are unique
+        c.execute("CREATE UNIQUE INDEX tree_comparisons_locus ON tree_comparisons (locus, tree)")
+        # jobs that still failed after their retries
+        query = """CREATE TABLE failures (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            locus text,
+            job text,
+            stage text,
+            attempts integer,
+            error text
+            )
+            """
+        c.execute(query)
+    except sqlite3.OperationalError, e:
+        log.critical("Database already exists")
+        if e[0] == 'table results already exists':
+            answer = raw_input("Database already exists.  Overwrite [Y/n]? ")
+            if answer == "Y" or "YES":
+                c.close()
+                conn.close()
+                os.remove(db_pth)
+                conn, c = create_results_database(args, log)
+            else:
+                sys.exit(2)
+        else:
+            log.critical("Cannot create database")
+            raise sqlite3.OperationalError("Cannot create database")
+    conn.commit()
+    return conn, c
+
+
+def insert_constraint_searches(cur, locus, constraint_map):
+    """Record which search stands in for each constraint at a locus.
+    `searched_as` is the job name of the search, or BEST where the pruned
+    constraint was a star tree and the unconstrained tree was used."""
+    rows = []
+    for constraint_name, search_job in constraint_map:
+        if search_job is None:
+            searched_as = "BEST"
+        else:
+            searched_as = search_job.split('.')[-3]
+        rows.append((locus, constraint_name, searched_as))
+    query = """INSERT INTO constraint_searches (
+        locus,
+        tree,
+        searched_as
+        ) VALUES (?,?,?)"""
+    cur.executemany(query, rows)
+
+
+def insert_search(cur, locus, constraint, replicates):
+    """Record the replicates run for the best-ML search (constraint of
+    None) or a constrained search.  Rows are committed with the locus."""
+    if constraint is None:
+        tree = "BEST"
+    else:
+        tree = constraint[0]
+    query = """INSERT INTO searches (
+        locus,
+        tree,
+        replicates
+        ) VALUES (?,?,?)"""
+    cur.execute(query, (locus, tree, replicates))
+
+
+def insert_timing(cur, job):
+    """Record the run time of a job and of the commands it ran.  Rows are
+    committed with the next locus to finish."""
+    query = """INSERT INTO job_timings (
+        locus,
+        job,
+        stage,
+        units,
+        predicted,
+        wall,
+        footprint,
+        predicted_memory,
+        threads
+        ) VALUES (?,?,?,?,?,?,?,?,?)"""
+    cur.execute(query, (
+        job.locus,
+        job.name,
+        job.stage,
+        job.units,
+        job.cost,
+        job.finished - job.started,
+        job.footprint,
+        job.memory,
+        job.threads
+    ))
+    query = """INSERT INTO timings (
+        locus,
+        job,
+        stage,
+        tree,
+        wall,
+        user,
+        sys,
+        maxrss_kb,
+        returncode
+        ) VALUES (?,?,?,?,?,?,?,?,?)"""
+    cur.executemany(query, [(
+        record.locus,
+        job.name,
+        record.stage,
+        record.constraint,
+        record.wall,
+        record.user,
+        record.sys,
+        record.maxrss_kb,
+        record.returncode
+    ) for record in job.records])
+
+
+def insert_failure(cur, job):
+    """Record a job that failed on every attempt.  Jobs downstream of it
+    never ran.  The caller commits the row, with the state of the job
+    in a queue."""
+    query = """INSERT INTO failures (
+        locus,
+        job,
+        stage,
+        attempts,
+        error
+        ) VALUES (?,?,?,?,?)"""
+    cur.execute(query, (job.locus, job.name, job.stage, job.attempts, job.error))
+
+
+def insert_constraints(conn, cur, constraints):
+    """Record the constraint newicks of the run, and commit them"""
+    query = "INSERT OR REPLACE INTO constraints (name, newick) VALUES (?,?)"
+    cur.executemany(query, sorted(constraints.items()))
+    conn.commit()
+
+
+def read_trees(trees):
+    """Read the (tree name, path) pairs of a locus into (tree name,
+    newick) pairs"""
+    rows = []
+    for tree_name, pth in trees:
+        with open(pth, 'rU') as infile:
+            rows.append((tree_name, infile.read().strip()))
+    return rows
+
+
+def insert_trees(cur, locus, trees):
+    """Record the (tree name, newick) pairs of the best tree (BEST) and
+    constrained trees of a locus.  Rows are committed with the SH-test
+    results."""
+    query = """INSERT INTO trees (
+        locus,
+        tree,
+        newick
+        ) VALUES (?,?,?)"""
+    cur.executemany(query, [(locus, tree_name, newick) for tree_name, newick in trees])
+
+
+def get_uncompared_trees(cur):
+    """Get the trees of loci that have no tree comparisons yet, as
+    {locus: {tree: newick}}"""
+    cur.execute("""SELECT locus, tree, newick FROM trees
+        WHERE locus NOT IN (SELECT DISTINCT locus FROM tree_comparisons)""")
+    loci = {}
+    for locus, tree_name, newick in cur.fetchall():
+        loci.setdefault(locus, {})[tree_name] = newick
+    return loci
+
+
+def insert_tree_comparisons(conn, cur, rows):
+    """Insert (locus, tree, ...) tree comparison rows and commit them.
+    Rows already there are kept."""
+    query = """INSERT OR IGNORE INTO tree_comparisons (
+        locus,
+        tree,
+        ntax,
+        rf,
+        max_rf,
+        clades,
+        clades_in_best,
+        missing_clades
+        ) VALUES (?,?,?,?,?,?,?,?)"""
+    cur.executemany(query, rows)
+    conn.commit()
+
+
+def insert_sh_test_results(cur, locus, sh_tests):
+    """Insert the SH-test rows for one locus.  The caller commits them
+    with the rest of the locus, so finished loci survive a crash."""
+    rows = []
+    for sh_test in sh_tests:
+        test_name = os.path.basename(sh_test[0]).split('.')[-3]
+        rows.append((locus, test_name,) + tuple(sh_test[1:]))
+    query = """INSERT INTO results (
+        locus,
+        tree,
+        ll,
+        ll_delta,
+        sd,
+        worse_five,
+        worse_two,
+        worse_one,
+        sh_p,
+        kh_p,
+        au_p,
+        elw
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"""
+    cur.executemany(query, rows)
+
+
+def read_artifacts(working_dir):
+    """Read every file in the working dir of a locus into (name, data)
+    pairs"""
+    artifacts = []
+    for name in sorted(os.listdir(working_dir)):
+        with open(os.path.join(working_dir, name), 'rb') as infile:
+            artifacts.append((name, sqlite3.Binary(infile.read())))
+    return artifacts
+
+
+def insert_artifacts(cur, locus, artifacts):
+    """Store the (name, data) files of a locus.  Rows are committed with
+    the SH-test results of the locus."""
+    query = """INSERT INTO artifacts (
+        locus,
+        name,
+        data
+        ) VALUES (?,?,?)"""
+    cur.executemany(query, [(locus, name, data) for name, data in artifacts])
+
+
+def extract_artifacts(cur, locus, dest):
+    """Write the stored files of a locus back out to dest"""
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    cur.execute("SELECT name, data FROM artifacts WHERE locus = ?", (locus,))
+    for name, data in cur.fetchall():
+        with open(os.path.join(dest, name), 'wb') as outfile:
+            outfile.write(data)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 19 October 2026 09:30 PDT (-0700)
+
+A job queue kept in the results database, so workers on any host that
+shares the output directory can work through one run.  Workers claim
+ready jobs with a lease, renew the lease while the job runs, and finish
+the job in the same transaction as its results.  Jobs whose lease runs
+out are handed to the next worker that asks, and count as a failure, so
+a job that keeps killing its worker is given up on like any other.
+"""
+
+
+import time
+import pickle
+import sqlite3
+import threading
+
+from sh_t.scheduler import get_priorities, run_job
+
+#import pdb
+
+
+def connect(db_pth):
+    """Open the results database for queue work.  Transactions are begun
+    by hand, so they can take the write lock up front."""
+    return sqlite3.connect(db_pth, timeout=600, isolation_level=None)
+
+
+def create_queue(conn):
+    conn.execute("""CREATE TABLE queue (
+        name text PRIMARY KEY,
+        locus text,
+        stage text,
+        priority float,
+        seq integer,
+        state text,
+        waiting integer,
+        job blob,
+        worker text,
+        lease_expires float,
+        attempts integer DEFAULT 0,
+        failures integer DEFAULT 0,
+        retries integer DEFAULT 0,
+        result blob,
+        error text
+        )
+        """)
+    conn.execute("CREATE INDEX queue_state ON queue (state, priority)")
+    conn.execute("""CREATE TABLE queue_depends (
+        job text,
+        dependent text
+        )
+        """)
+    conn.execute("CREATE INDEX queue_depends_job ON queue_depends (job)")
+    conn.execute("CREATE INDEX queue_depends_dependent ON queue_depends (dependent)")
+
+
+def enqueue_jobs(conn, jobs):
+    """Add a graph of jobs to the queue.  Jobs without dependencies are
+    ready at once; the others wait on a count of unfinished dependencies."""
+    priorities = get_priorities(jobs)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for cnt, job in enumerate(jobs):
+            conn.execute("""INSERT INTO queue (
+                name,
+                locus,
+                stage,
+                priority,
+                seq,
+                state,
+                waiting,
+                retries,
+                job
+                ) VALUES (?,?,?,?,?,?,?,?,?)""", (
+                job.name,
+                job.locus,
+                job.stage,
+                priorities[job.name],
+                cnt,
+                "waiting" if job.depends else "ready",
+                len(job.depends),
+                job.retries,
+                sqlite3.Binary(pickle.dumps(job, 2))
+            ))
+            conn.executemany(
+                "INSERT INTO queue_depends (job, dependent) VALUES (?,?)",
+                [(dep, job.name) for dep in job.depends]
+            )
+    except:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def expire_leases(conn, now, record_failure=None):
+    """Return running jobs whose lease has run out to the queue, counting
+    each as a failure.  Jobs out of retries fail, and are passed to
+    record_failure().  Call within a transaction."""
+    expired = conn.execute("""SELECT name, job, worker, attempts, failures, retries FROM queue
+        WHERE state = 'running' AND lease_expires < ?""", (now,)).fetchall()
+    for name, job, holder, attempts, failures, retries in expired:
+        state = "ready" if failures < retries else "failed"
+        error = "The lease held by {} expired".format(holder)
+        conn.execute("""UPDATE queue SET state = ?, failures = failures + 1, error = ?, worker = NULL
+            WHERE name = ?""", (state, error, name))
+        if state == "failed" and record_failure is not None:
+            job = pickle.loads(str(job))
+            job.attempts = attempts
+            job.error = error
+            record_failure(job)
+
+
+def claim_job(conn, worker, lease, record_failure=None):
+    """Take the ready job with the highest priority, first returning jobs
+    with expired leases to the queue (see expire_leases()).  Returns
+    (job, upstream results), or None when no job is ready."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        expire_leases(conn, now, record_failure)
+        row = conn.execute("""SELECT name, job, attempts FROM queue WHERE state = 'ready'
+            ORDER BY priority DESC, seq LIMIT 1""").fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        name, job, attempts = row
+        conn.execute("""UPDATE queue SET state = 'running', worker = ?,
+            lease_expires = ?, attempts = attempts + 1 WHERE name = ?""", (worker, now + lease, name))
+        upstream = dict([
+            (dep, pickle.loads(str(result)))
+            for dep, result in conn.execute("""SELECT q.name, q.result FROM queue_depends d
+                JOIN queue q ON q.name = d.job WHERE d.dependent = ?""", (name,))
+        ])
+    except:
+        conn.rollback()
+        raise
+    conn.commit()
+    job = pickle.loads(str(job))
+    # retries, and runs after a lease expired, get new seeds
+    job.attempts = attempts + 1
+    return job, upstream
+
+
+def renew_lease(conn, name, worker, lease):
+    """Push back the lease on a running job.  Returns False if the job is
+    no longer ours."""
+    cur = conn.execute("""UPDATE queue SET lease_expires = ?
+        WHERE name = ? AND worker = ? AND state = 'running'""", (time.time() + lease, name, worker))
+    return cur.rowcount == 1
+
+
+def heartbeat(db_pth, name, worker, lease, interval, stop):
+    """Renew the lease on a job every interval seconds until stop is set.
+    Runs in its own thread, with its own connection."""
+    conn = connect(db_pth)
+    try:
+        while not stop.wait(interval):
+            if not renew_lease(conn, name, worker, lease):
+                break
+    finally:
+        conn.close()
+
+
+def complete_job(conn, job, worker, result, error, record=None, record_failure=None):
+    """Mark a job done (or failed), release its dependents, and call
+    record() to write its results, all in one transaction.  Other
+    workers wait on the transaction, so record() should only insert
+    rows, without committing them.  A failed job goes back in the queue
+    until it has failed job.retries + 1 times, when record_failure() is
+    called instead.  Returns the new state of the job ("done", "ready"
+    to run again, or "failed"), or None without changing anything if the
+    lease on the job was lost."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT worker, state, failures FROM queue WHERE name = ?", (job.name,)).fetchone()
+        if row is None or row[:2] != (worker, "running"):
+            conn.rollback()
+            return None
+        if error is not None:
+            state = "ready" if row[2] < job.retries else "failed"
+            conn.execute("""UPDATE queue SET state = ?, failures = failures + 1, error = ?, worker = NULL
+                WHERE name = ?""", (state, error, job.name))
+            if state == "failed" and record_failure is not None:
+                job.error = error
+                record_failure()
+        else:
+            state = "done"
+            has_dependents = conn.execute(
+                "SELECT COUNT(*) FROM queue_depends WHERE job = ?", (job.name,)
+            ).fetchone()[0]
+            if has_dependents:
+                # dependents read this when they're claimed
+                result = sqlite3.Binary(pickle.dumps(result, 2))
+            else:
+                result = None
+            conn.execute("""UPDATE queue SET state = 'done', result = ?, worker = NULL
+                WHERE name = ?""", (result, job.name))
+            conn.execute("""UPDATE queue SET waiting = waiting - 1
+                WHERE name IN (SELECT dependent FROM queue_depends WHERE job = ?)""", (job.name,))
+            conn.execute("UPDATE queue SET state = 'ready' WHERE state = 'waiting' AND waiting = 0")
+            if record is not None:
+                record()
+    except:
+        conn.rollback()
+        raise
+    conn.commit()
+    return state
+
+
+def count_jobs(conn):
+    """Count the jobs in each state"""
+    return dict(conn.execute("SELECT state, COUNT(*) FROM queue GROUP BY state").fetchall())
+
+
+def has_work(conn):
+    """Check for jobs that are ready or running.  Waiting jobs downstream
+    of a failure never become ready, so they don't count."""
+    counts = count_jobs(conn)
+    return counts.get("ready", 0) + counts.get("running", 0) > 0
+
+
+def run_worker(conn, db_pth, worker, lease=300., poll=5., store=None, record=None, finish=None, record_failure=None, log=None):
+    """Claim and run jobs until none are ready or running.
+
+    Each finished job is first passed to store(job, result), outside any
+    transaction, for work on files.  Its return value goes to
+    record(job, result, stored) inside the transaction that completes
+    the job, and once that commits the job is passed to finish(job).
+    Each job that fails for good, here or by its lease running out, is
+    passed to record_failure(job) inside the transaction that fails it.
+    Returns the numbers of jobs this worker finished and failed."""
+    done = 0
+    failed = 0
+    if record_failure is not None and log is not None:
+        def record_expired(job):
+            log.error("Job {} failed after its lease expired:\n{}".format(job.name, job.error))
+            record_failure(job)
+    else:
+        record_expired = record_failure
+    while True:
+        claimed = claim_job(conn, worker, lease, record_expired)
+        if claimed is None:
+            if not has_work(conn):
+                return done, failed
+            # wait for running jobs to finish, or their leases to expire
+            time.sleep(poll)
+            continue
+        job, upstream = claimed
+        if log is not None:
+            log.info("Running {}".format(job.name))
+        stop = threading.Event()
+        beat = threading.Thread(
+            target=heartbeat,
+            args=(db_pth, job.name, worker, lease, lease / 3., stop)
+        )
+        beat.daemon = True
+        beat.start()
+        job.started = time.time()
+        try:
+            name, attempt, result, error, job.records = run_job(
+                job.name,
+                job.func,
+                job.work,
+                upstream,
+                job.attempts - 1,
+                job.timeout
+            )
+        finally:
+            stop.set()
+            beat.join()
+        job.finished = time.time()
+        if error is not None and log is not None:
+            log.error("Job {} failed:\n{}".format(job.name, error))
+        if error is None and store is not None:
+            # a slow store doesn't hold up the other workers
+            stored = store(job, result)
+        else:
+            stored = None
+        if record is not None and error is None:
+            callback = lambda: record(job, result, stored)
+        else:
+            callback = None
+        if record_failure is not None:
+            failure_callback = lambda: record_failure(job)
+        else:
+            failure_callback = None
+        state = complete_job(conn, job, worker, result, error, callback, failure_callback)
+        if state == "done":
+            done += 1
+            if finish is not None:
+                finish(job)
+        elif state == "failed":
+            failed += 1
+            if log is not None:
+                log.error("Job {} failed after {} attempts".format(job.name, job.attempts))
+        elif state is None and log is not None:
+            log.warn("Lost the lease on {}; dropped its results".format(job.name))
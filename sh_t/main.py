@@ -16,172 +16,173 @@ from __future__ import absolute_import
 import os
 import re
 import sys
-import yaml
-import glob
+import time
+import errno
 import shutil
+import socket
+import tarfile
 import random
-import sqlite3
-import dendropy
-import subprocess
-import multiprocessing
 
+from sh_t import db
+from sh_t import cache
+from sh_t import costs
+from sh_t import memory
+from sh_t import constraints
 from sh_t import core
+from sh_t import commands
+from sh_t import compress
+from sh_t import stats
+from sh_t import sitelh
+from sh_t import progress
+from sh_t import bipartitions
 from sh_t.log import setup_logging
+from sh_t import jobqueue
+from sh_t import scheduler
+from sh_t.scheduler import Job, run_jobs
 
 #import pdb
 
 
-def get_best_ML_tree(working_dir, raxml, alignment, orig_aln_name, searches=20):
-    cmd = [
-        raxml,
+# the locus subdir holding the private dirs of job attempts
+ATTEMPTS = "attempts"
+
+
+def get_best_ML_tree(working_dir, raxml, alignment, orig_aln_name, searches=20, seed=None, postfix="BEST", weights=None):
+    if seed is None:
+        seed = random.randrange(1,100000000)
+    cmd = raxml + [
+        "-w",
+        working_dir,
         "-m",
         "GTRGAMMA",
         "-p",
-        str(random.randrange(1,100000000)),
+        str(seed),
         "-s",
         alignment,
         "-N",
         str(searches),
         "-n",
-        "{}.BEST".format(orig_aln_name)
+        "{}.{}".format(orig_aln_name, postfix)
     ]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    best_tree = os.path.join(working_dir, "RAxML_bestTree.{}.BEST".format(orig_aln_name))
+    if weights is not None:
+        cmd.extend(["-a", weights])
+    record, stdout = commands.check(cmd, "BEST", orig_aln_name, cwd=working_dir)
+    best_tree = os.path.join(working_dir, "RAxML_bestTree.{}.{}".format(orig_aln_name, postfix))
     # cleanup temp files
-    cleanup_raxml_temp_files(working_dir, orig_aln_name, "BEST")
+    cleanup_raxml_temp_files(working_dir, orig_aln_name, postfix)
     # return best tree name
     return best_tree
 
 
+def get_model_parameters(working_dir, raxml, alignment, orig_aln_name, best_tree, weights=None):
+    """Optimize model parameters on the best tree and save them for -R"""
+    cmd = raxml + [
+        "-w",
+        working_dir,
+        "-f",
+        "e",
+        "-m",
+        "GTRGAMMA",
+        "-t",
+        best_tree,
+        "-s",
+        alignment,
+        "-n",
+        "{}.MODEL".format(orig_aln_name)
+    ]
+    if weights is not None:
+        cmd.extend(["-a", weights])
+    record, stdout = commands.check(cmd, "MODEL", orig_aln_name, cwd=working_dir)
+    model = os.path.join(working_dir, "RAxML_binaryModelParameters.{}.MODEL".format(orig_aln_name))
+    return model
+
+
+def get_model_path(working_dir, orig_aln_name, reuse_model):
+    if reuse_model:
+        return os.path.join(working_dir, "RAxML_binaryModelParameters.{}.MODEL".format(orig_aln_name))
+    else:
+        return None
+
+
+def get_best_likelihood(info):
+    """Get the final likelihood of the best tree from a RAxML_info file"""
+    regex = re.compile("Final GAMMA-based Score of best tree (-?\d+\.\d+)")
+    with open(info, 'rU') as infile:
+        match = regex.search(infile.read())
+    if match:
+        return float(match.groups()[0])
+    else:
+        return None
+
+
 def cleanup_raxml_temp_files(working_dir, aln_name, postfix):
-    for name_stub in [
-            "RAxML_log.{}.{}.RUN.*".format(aln_name, postfix),
-            "RAxML_parsimonyTree.{}.{}.RUN.*".format(aln_name, postfix),
-            "RAxML_result.{}.{}.RUN.*".format(aln_name, postfix)
-        ]:
-        [os.remove(f) for f in glob.glob(os.path.join(working_dir, name_stub))]
+    # one listing of the dir, rather than a glob for each kind of file
+    prefixes = tuple([
+        "RAxML_{}.{}.{}.RUN.".format(kind, aln_name, postfix)
+        for kind in ["log", "parsimonyTree", "result"]
+    ])
+    for name in os.listdir(working_dir):
+        if name.startswith(prefixes):
+            os.remove(os.path.join(working_dir, name))
 
 
-def get_best_constraint_tree(working_dir, raxml, alignment, orig_aln_name, constraint, searches=20):
+def get_best_constraint_tree(working_dir, raxml, alignment, orig_aln_name, constraint, searches=20, seed=None, model=None, postfix=None, weights=None):
     constraint_name, constraint_tree_pth = constraint
-    cmd = [
-        raxml,
+    if postfix is None:
+        postfix = "{}.constraint.BEST".format(constraint_name)
+    if seed is None:
+        seed = random.randrange(1,100000000)
+    cmd = raxml + [
+        "-w",
+        working_dir,
         "-g",
         constraint_tree_pth,
         "-m",
         "GTRGAMMA",
         "-p",
-        str(random.randrange(1,100000000)),
+        str(seed),
         "-s",
         alignment,
         "-N",
         str(searches),
         "-n",
-        "{}.{}.constraint.BEST".format(orig_aln_name, constraint_name)
+        "{}.{}".format(orig_aln_name, postfix)
     ]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    best_constraint_tree = os.path.join(working_dir, "RAxML_bestTree.{}.{}.constraint.BEST".format(orig_aln_name, constraint_name))
+    if model is not None:
+        # start from the model parameters of the unconstrained search
+        cmd.extend(["-R", model])
+    if weights is not None:
+        cmd.extend(["-a", weights])
+    record, stdout = commands.check(cmd, "CONSTRAINT", orig_aln_name, constraint_name, cwd=working_dir)
+    best_constraint_tree = os.path.join(working_dir, "RAxML_bestTree.{}.{}".format(orig_aln_name, postfix))
     # cleanup temp files
-    cleanup_raxml_temp_files(working_dir, orig_aln_name, "{}.constraint.BEST".format(constraint_name))
+    cleanup_raxml_temp_files(working_dir, orig_aln_name, postfix)
     # return best tree name
     return best_constraint_tree
 
 
 def prune_and_normalize_constraint_tree(working_dir, alignment_taxa, orig_aln_name, constraint):
     constraint_name, constraint_string = constraint
-    constraint_tree = dendropy.Tree.get_from_string(constraint_string, schema="newick",  preserve_underscores=True)
-    # get taxa in constraint tree
-    constraint_taxa = set(constraint_tree.infer_taxa().labels())
-    # find which taxa are missing
-    intersect = list(constraint_taxa.intersection(alignment_taxa))
-    # prune constraint tree to remove missing taxa
-    constraint_tree.retain_taxa_with_labels(intersect)
-    # set_branch_lengths_equal
-    for edge in constraint_tree.preorder_edge_iter():
-        if edge.length:
-            edge.length = 1.0
+    newick = constraints.get_pruned_constraint(constraint, alignment_taxa)
     constraint_tree_pth = os.path.join(
         working_dir,
         "{}.{}.constraint.tre".format(orig_aln_name, constraint_name)
     )
-    constraint_tree.write_to_path(
-            constraint_tree_pth,
-            "newick"
-        )
+    with open(constraint_tree_pth, 'w') as outfile:
+        outfile.write(newick)
     return constraint_name, constraint_tree_pth
 
 
-def get_merged_constraint_trees(working_dir, orig_aln_name, best_constraint_trees):
-    merged_constraint_tree_pth = os.path.join(
-        working_dir,
-        "{}.MERGED.constraint.tre".format(orig_aln_name)
-    )
-    treelist = dendropy.TreeList()
-    tree_map = {}
-    for cnt, constraint_tree in enumerate(best_constraint_trees):
-        treelist.read_from_path(constraint_tree, schema="newick", preserve_underscores=True)
-        tree_map[cnt] = constraint_tree
-    treelist.write_to_path(
-        merged_constraint_tree_pth,
-        "newick"
-    )
-    return merged_constraint_tree_pth, tree_map
-
-
-def get_sh_test_results(working_dir, raxml, alignment, orig_aln_name, best_tree, merged_constraint):
-    cmd = [
-        raxml,
-        "-f",
-        "H",
-        "-m",
-        "GTRGAMMA",
-        "-t",
-        best_tree,
-        "-z",
-        merged_constraint,
-        "-s",
-        alignment,
-        "-n",
-        "{}.constraints.SHTEST".format(orig_aln_name)
-    ]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    sh_test_result = os.path.join(working_dir, "RAxML_info.{}.constraints.SHTEST".format(orig_aln_name))
-    # return sh_test results
-    return sh_test_result
-
-
-def filter_sh_test_results(sh_test, tree_map, orig_aln_name):
-    regex = re.compile("""
-        Tree:\s(\d+)\s              # capture tree num
-        Likelihood:\s(-\d+\.\d+)\s  # capture loglik
-        \\D\(LH\):\s(-*\d+\.\d+)\s   # capture loglike Delta
-        SD:\s(\d+\.\d+)\s           # get SD
-        Significantly\sWorse\:\s+   # capture test values
-        (\w+)\s\(\d+\%\),\s+(\w+)\s\(\d+\%\),\s+(\w+)\s\(\d+\%\)
-        """, re.VERBOSE)
-    with open(sh_test, 'rU') as infile:
-        temp_results = re.findall(regex, infile.read())
-    # add actual tree name to results
-    results = [(tree_map[int(i[0])],) + i[1:] for i in temp_results]
-    return orig_aln_name, results
-
-
-def get_all_merged_trees(working_dir, orig_aln_name, tree_map, best, merged_constraint_trees):
+def get_all_merged_trees(working_dir, orig_aln_name, trees):
+    """Write the trees to test, with branch lengths of 1, to one file"""
+    import dendropy
     all_tree_pth = os.path.join(
         working_dir,
         "{}.ALL.MERGED.tre".format(orig_aln_name)
     )
     treelist = dendropy.TreeList()
-    # join merged
-    all_trees = [merged_constraint_trees, best]
-    for cnt, tree in enumerate(all_trees):
+    for tree in trees:
         treelist.read_from_path(tree, schema="newick", preserve_underscores=True)
-    # we're inserting the best tree last in the all-merged tree file
-    # so add appropriate index
-    tree_map[max(tree_map.keys()) + 1] = best
     # set branch lengths = 1
     for tree in treelist:
         for edge in tree.preorder_edge_iter():
@@ -191,12 +192,13 @@ def get_all_merged_trees(working_dir, orig_aln_name, tree_map, best, merged_cons
         all_tree_pth,
         "newick"
     )
-    return all_tree_pth, tree_map
+    return all_tree_pth
 
 
-def get_site_lls_tree_puzzle(working_dir, raxml, alignment, orig_aln_name, all_tree_pth):
-    cmd = [
-        raxml,
+def get_site_lls_tree_puzzle(working_dir, raxml, alignment, orig_aln_name, all_tree_pth, model=None, weights=None):
+    cmd = raxml + [
+        "-w",
+        working_dir,
         "-f",
         "G",
         "-m",
@@ -208,40 +210,197 @@ def get_site_lls_tree_puzzle(working_dir, raxml, alignment, orig_aln_name, all_t
         "-n",
         "{}.sitelh".format(orig_aln_name)
     ]
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    puzzle_result = os.path.join(working_dir, "RAxML_info.{}.puzzle.SITELH".format(orig_aln_name))
-    # return sh_test results
+    if model is not None:
+        # start from the model parameters of the unconstrained search
+        cmd.extend(["-R", model])
+    if weights is not None:
+        cmd.extend(["-a", weights])
+    record, stdout = commands.check(cmd, "SITELH", orig_aln_name, cwd=working_dir)
+    puzzle_result = os.path.join(working_dir, "RAxML_perSiteLLs.{}.sitelh".format(orig_aln_name))
+    # return the per-site likelihoods of each tree
     return puzzle_result
 
 
-def worker(work):
-    # get starting dir
-    owd = os.getcwd()
-    # unpack work
-    args, raxml, orig_alignment, constraints = work
-    # make a locus specific working dir
-    orig_aln_full_name = os.path.basename(orig_alignment)
+def get_tree_test_results(site_lls, trees, replicates, seed):
+    """Run the tree selection tests and make one row for each tree.  A tree
+    is significantly worse at a level when the SH test rejects it."""
+    tests = stats.tree_tests(site_lls, replicates, seed)
+    results = []
+    for cnt, tree in enumerate(trees):
+        results.append((
+            tree,
+            tests["ll"][cnt],
+            tests["delta"][cnt],
+            tests["sd"][cnt],
+        ) + tuple(
+            ["Yes" if tests["sh"][cnt] < alpha else "No" for alpha in (0.05, 0.02, 0.01)]
+        ) + (
+            tests["sh"][cnt],
+            tests["kh"][cnt],
+            tests["au"][cnt],
+            tests["elw"][cnt]
+        ))
+    return results
+
+
+def stage_locus(args, alignment):
+    """Make a locus-specific working dir, under --scratch when it is given,
+    holding a link to the alignment or its compressed form with --compress"""
+    orig_aln_full_name = os.path.basename(alignment)
     orig_aln_name = os.path.splitext(orig_aln_full_name)[0]
-    working_dir = os.path.join(args.output, orig_aln_name)
-    os.makedirs(working_dir)
-    # copy old aln to new directory
-    working_alignment = os.path.join(working_dir, orig_aln_full_name)
-    shutil.copyfile(orig_alignment, working_alignment)
-    # change to new aln working dir
-    os.chdir(working_dir)
-    # estimate the best ML tree for the data
-    best_tree = get_best_ML_tree(
-        working_dir,
-        raxml,
-        working_alignment,
-        orig_aln_name,
-        args.searches
-    )
-    # under each of the constraints, estimate the best constrained ML tree
-    taxa_present = core.get_taxa_in_alignment(working_alignment)
-    best_constraint_trees = []
-    for constraint in constraints.items():
+    working_dir = os.path.join(args.scratch or args.output, orig_aln_name)
+    if not os.path.isdir(working_dir):
+        os.makedirs(working_dir)
+    # an interrupted run leaves the markers of the attempts that kept
+    # their files, which would keep this run's jobs from keeping theirs
+    shutil.rmtree(os.path.join(working_dir, ATTEMPTS), ignore_errors=True)
+    if args.compress:
+        working_alignment, compression = compress.stage_compressed_alignment(
+            alignment,
+            working_dir,
+            orig_aln_name
+        )
+    else:
+        # link old aln into new directory
+        working_alignment = os.path.join(working_dir, orig_aln_full_name)
+        core.link_or_copy(alignment, working_alignment)
+        compression = None
+    return orig_aln_name, working_dir, working_alignment, compression
+
+
+def pack_locus_tar(output, orig_aln_name, working_dir):
+    """Pack the files of a finished locus into <output>/<locus>.tar.gz"""
+    tar_pth = os.path.join(output, "{}.tar.gz".format(orig_aln_name))
+    # don't leave a partial archive behind if we're interrupted.  a
+    # worker that lost its lease may be packing the same locus, so each
+    # writes its own file.
+    tmp_pth = "{}.{}.{}.tmp".format(tar_pth, socket.gethostname(), os.getpid())
+    with tarfile.open(tmp_pth, "w:gz") as tar:
+        for name in sorted(os.listdir(working_dir)):
+            tar.add(os.path.join(working_dir, name), os.path.join(orig_aln_name, name))
+    os.rename(tmp_pth, tar_pth)
+
+
+def finish_locus(args, orig_aln_name, working_dir):
+    """Move a finished locus out of --scratch, or remove its working dir
+    once it has been packed"""
+    if args.pack is not None:
+        shutil.rmtree(working_dir)
+    elif args.scratch is not None:
+        dest = os.path.join(args.output, orig_aln_name)
+        if os.path.isdir(dest):
+            shutil.rmtree(dest)
+        shutil.move(working_dir, dest)
+
+
+def get_weights(compression):
+    """Get the column weights of a compressed locus for RAxML -a"""
+    if compression is None:
+        return None
+    else:
+        return compression[0]
+
+
+def get_seed(key):
+    """Derive a RAxML seed from a cache key.  Retries and duplicate copies
+    of a job get new seeds."""
+    attempt = scheduler.get_attempt()
+    if attempt > 0:
+        key = cache.get_key(key, "attempt", attempt)
+    return cache.get_seed(key)
+
+
+def start_attempt(work, label, link_model=True):
+    """Give this attempt at a job a dir of its own under the locus dir, so
+    retries and duplicate copies of a job never share RAxML's files.
+    Unless the job makes them, the model parameters of the locus are
+    linked in.  Returns the work of the job with the attempt dir in place
+    of the locus dir, and the names of the linked files."""
+    args, raxml, orig_aln_name, working_dir = work[:4]
+    attempt_dir = os.path.join(working_dir, ATTEMPTS, "{}.{}".format(label, scheduler.get_attempt()))
+    if os.path.isdir(attempt_dir):
+        # left by a worker that lost its lease
+        shutil.rmtree(attempt_dir)
+    os.makedirs(attempt_dir)
+    linked = []
+    model = get_model_path(working_dir, orig_aln_name, args.reuse_model)
+    if link_model and model is not None and os.path.isfile(model):
+        core.link_or_copy(model, os.path.join(attempt_dir, os.path.basename(model)))
+        linked.append(os.path.basename(model))
+    return work[:3] + (attempt_dir,) + work[4:], linked
+
+
+def finish_attempt(working_dir, attempt_dir, label, linked, wait=60.):
+    """Move the files an attempt made into the locus dir.  The first copy
+    of a job to finish keeps its files.  Later copies drop theirs and
+    wait (up to `wait` seconds) for the first copy's to be in place."""
+    claimed = os.path.join(working_dir, ATTEMPTS, "{}.claimed".format(label))
+    kept = os.path.join(working_dir, ATTEMPTS, "{}.kept".format(label))
+    try:
+        os.close(os.open(claimed, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+        shutil.rmtree(attempt_dir)
+        start = time.time()
+        while not os.path.exists(kept):
+            if time.time() - start > wait:
+                raise IOError("Another copy of {} never finished keeping its files".format(label))
+            time.sleep(0.1)
+        return
+    for name in os.listdir(attempt_dir):
+        if name not in linked:
+            os.rename(os.path.join(attempt_dir, name), os.path.join(working_dir, name))
+    shutil.rmtree(attempt_dir)
+    open(kept, 'w').close()
+
+
+def get_kept_files(working_dir, files):
+    """Get the paths files (a dict of {name: path} in an attempt dir) have
+    once they are kept in the locus dir"""
+    return dict([(name, os.path.join(working_dir, os.path.basename(pth))) for name, pth in files.items()])
+
+
+def get_search_key(locus_key, taxa_present, constraint):
+    if constraint is None:
+        return cache.get_key(locus_key, "BEST")
+    else:
+        # key on the taxa and bipartitions the constraint places on this
+        # locus
+        newick, taxa, splits = constraints.prune_constraint(constraint, taxa_present)
+        return cache.get_key(locus_key, constraints.format_splits(taxa, splits))
+
+
+def get_search_postfix(constraint):
+    if constraint is None:
+        return "BEST"
+    else:
+        return "{}.constraint.BEST".format(constraint[0])
+
+
+def get_search_files(working_dir, orig_aln_name, postfix):
+    return {
+        "bestTree": os.path.join(working_dir, "RAxML_bestTree.{}.{}".format(orig_aln_name, postfix)),
+        "info": os.path.join(working_dir, "RAxML_info.{}.{}".format(orig_aln_name, postfix))
+    }
+
+
+def run_search(work, constraint, searches, seed, postfix):
+    """Run the best-ML search, or a constrained search, in the locus dir"""
+    args, raxml, orig_aln_name, working_dir, working_alignment, locus_key, taxa_present, compression = work[:8]
+    if constraint is None:
+        # estimate the best ML tree for the data
+        get_best_ML_tree(
+            working_dir,
+            raxml,
+            working_alignment,
+            orig_aln_name,
+            searches,
+            seed,
+            postfix,
+            get_weights(compression)
+        )
+    else:
         # pull out missing taxa from constraint tree
         constraint = prune_and_normalize_constraint_tree(
             working_dir,
@@ -250,158 +409,770 @@ def worker(work):
             constraint
         )
         # feed constraint tree and alignment to raxml
-        best_constraint_tree = get_best_constraint_tree(
+        get_best_constraint_tree(
             working_dir,
             raxml,
             working_alignment,
             orig_aln_name,
             constraint,
-            args.searches
+            searches,
+            seed,
+            get_model_path(working_dir, orig_aln_name, args.reuse_model),
+            postfix,
+            get_weights(compression)
         )
-        best_constraint_trees.append(best_constraint_tree)
-    # get all constraint trees into one file
-    merged_constraint_trees, merged_constraint_tree_map = get_merged_constraint_trees(
-        working_dir,
-        orig_aln_name,
-        best_constraint_trees
+    return get_search_files(working_dir, orig_aln_name, postfix)
+
+
+def run_adaptive_search(work, constraint, key, postfix, search_files):
+    """Run replicates in batches of --batch-searches until the best
+    likelihood has not improved by more than --tolerance for --patience
+    batches, or --max-searches have run.  The best batch is copied to
+    search_files, and the number of replicates is returned."""
+    args, raxml, orig_aln_name, working_dir = work[:4]
+    batches = []
+    best = float("-inf")
+    stale = 0
+    replicates = 0
+    while replicates < args.max_searches and stale < args.patience:
+        searches = min(args.batch_searches, args.max_searches - replicates)
+        batch = run_search(
+            work,
+            constraint,
+            searches,
+            get_seed(cache.get_key(key, "batch", len(batches))),
+            "{}.batch{}".format(postfix, len(batches))
+        )
+        batches.append(batch)
+        replicates += searches
+        ll = get_best_likelihood(batch["info"])
+        if ll > best + args.tolerance:
+            stale = 0
+        else:
+            stale += 1
+        best = max(best, ll)
+    pick_best_shard(batches, search_files)
+    for batch in batches:
+        [os.remove(pth) for pth in batch.values()]
+    return replicates
+
+
+def get_replicates_path(working_dir, orig_aln_name, postfix):
+    return os.path.join(working_dir, "{}.{}.replicates".format(orig_aln_name, postfix))
+
+
+def shard_job(work, upstream):
+    """Run a share of a search's replicates with its own seed"""
+    args, raxml, orig_aln_name, working_dir, working_alignment, locus_key, taxa_present, compression, constraint, shard, searches = work
+    key = get_search_key(locus_key, taxa_present, constraint)
+    if cache.has(args.cache, key, ["bestTree", "info"]):
+        return None
+    postfix = "{}.shard{}".format(get_search_postfix(constraint), shard)
+    attempt, linked = start_attempt(work, postfix)
+    files = run_search(
+        attempt,
+        constraint,
+        searches,
+        get_seed(cache.get_key(key, shard)),
+        postfix
     )
-    # run SH test of unconstrained against constrained
-    sh_test = get_sh_test_results(
-        working_dir,
-        raxml,
-        working_alignment,
-        orig_aln_name,
-        best_tree,
-        merged_constraint_trees
+    finish_attempt(working_dir, attempt[3], postfix, linked)
+    return get_kept_files(working_dir, files)
+
+
+def pick_best_shard(shards, search_files):
+    """Copy the most likely shard result to the search's own files.  Ties go
+    to the first shard so the choice is deterministic."""
+    best = None
+    for shard in shards:
+        ll = get_best_likelihood(shard["info"])
+        if best is None or ll > best[0]:
+            best = (ll, shard)
+    for name, pth in best[1].items():
+        shutil.copyfile(pth, search_files[name])
+
+
+def search_job(work, upstream):
+    """Get the best-ML tree, or the best tree under a constraint"""
+    args, raxml, orig_aln_name, working_dir, working_alignment, locus_key, taxa_present, compression, constraint, shard_jobs = work
+    key = get_search_key(locus_key, taxa_present, constraint)
+    postfix = get_search_postfix(constraint)
+    # the best-ML search makes the model parameters the others start from
+    attempt, linked = start_attempt(work, postfix, link_model=constraint is not None)
+    attempt_dir = attempt[3]
+    cached = get_search_files(attempt_dir, orig_aln_name, postfix)
+    model = None
+    if constraint is None:
+        model = get_model_path(attempt_dir, orig_aln_name, args.reuse_model)
+        if model is not None:
+            cached["model"] = model
+    if args.adaptive:
+        # the replicates used vary, so keep the count with the results
+        cached["replicates"] = get_replicates_path(attempt_dir, orig_aln_name, postfix)
+    shards = [upstream[name] for name in shard_jobs]
+    if not cache.fetch(args.cache, key, cached):
+        if shards:
+            pick_best_shard(shards, cached)
+        elif args.adaptive:
+            replicates = run_adaptive_search(attempt, constraint, key, postfix, cached)
+            with open(cached["replicates"], 'w') as outfile:
+                outfile.write("{}\n".format(replicates))
+        else:
+            run_search(attempt, constraint, args.searches, get_seed(key), postfix)
+        if model is not None:
+            # save model parameters for the downstream searches and tests
+            get_model_parameters(
+                attempt_dir,
+                raxml,
+                working_alignment,
+                orig_aln_name,
+                cached["bestTree"],
+                get_weights(compression)
+            )
+        cache.store(args.cache, key, cached)
+    finish_attempt(working_dir, attempt_dir, postfix, linked)
+    for shard in shards:
+        # shards of a cached search never ran
+        if shard is not None:
+            [os.remove(pth) for pth in shard.values() if os.path.exists(pth)]
+    cached = get_kept_files(working_dir, cached)
+    return cached["bestTree"], get_replicates(args, cached)
+
+
+def get_replicates(args, search_files):
+    """Get the number of replicates behind a search"""
+    if "replicates" in search_files:
+        with open(search_files["replicates"], 'rU') as infile:
+            return int(infile.read())
+    else:
+        return args.searches
+
+
+def get_shard_count(args):
+    """Adaptive searches decide how many replicates to run as they go, so
+    they aren't sharded"""
+    if args.adaptive:
+        return 1
+    else:
+        return min(args.shards, args.searches)
+
+
+def get_search_jobs(args, locus, constraint, depends=(), size=0, footprint=0, threads=1):
+    """Make the jobs for one search, split into shards of replicates when
+    --shards is above one.  size is taxa x sites for the locus, footprint
+    the modelled memory of RAxML on it, and threads the threads RAxML
+    runs with."""
+    orig_aln_name = locus[2]
+    if constraint is None:
+        name = "{}.BEST".format(orig_aln_name)
+        stage = "BEST"
+    else:
+        name = "{}.{}.constraint.BEST".format(orig_aln_name, constraint[0])
+        stage = "CONSTRAINT"
+    shards = get_shard_count(args)
+    shard_jobs = []
+    if shards > 1:
+        for shard in xrange(shards):
+            replicates = args.searches // shards + (shard < args.searches % shards)
+            shard_jobs.append(Job(
+                "{}.shard{}".format(name, shard),
+                shard_job,
+                locus + (constraint, shard, replicates),
+                depends=depends,
+                locus=orig_aln_name,
+                stage=stage,
+                units=size * replicates,
+                footprint=footprint,
+                threads=threads
+            ))
+        depends = [job.name for job in shard_jobs]
+        units = 0
+    elif args.adaptive:
+        # every search runs at least patience + 1 batches
+        units = size * min(args.max_searches, args.batch_searches * (args.patience + 1))
+    else:
+        units = size * args.searches
+    job = Job(
+        name,
+        search_job,
+        locus + (constraint, [job.name for job in shard_jobs]),
+        depends=depends,
+        locus=orig_aln_name,
+        stage=stage,
+        units=units,
+        footprint=footprint,
+        threads=threads
     )
-    sh_test_results = filter_sh_test_results(
-        sh_test,
-        merged_constraint_tree_map,
-        orig_aln_name
+    return shard_jobs + [job]
+
+
+def sh_test_job(work, upstream):
+    args, raxml, orig_aln_name, working_dir, working_alignment, locus_key, taxa_present, compression, best_job, constraint_map = work
+    attempt, linked = start_attempt(work, "SHTEST")
+    attempt_dir = attempt[3]
+    best_tree = upstream[best_job][0]
+    # fan searches out to every constraint they stand in for
+    best_constraint_trees = []
+    for constraint_name, search_job in constraint_map:
+        best_constraint_tree = os.path.join(
+            attempt_dir,
+            "RAxML_bestTree.{}.{}.constraint.BEST".format(orig_aln_name, constraint_name)
+        )
+        if search_job is None:
+            shutil.copyfile(best_tree, best_constraint_tree)
+        else:
+            shutil.copyfile(upstream[search_job][0], best_constraint_tree)
+        best_constraint_trees.append(best_constraint_tree)
+    # the tests only need re-running when one of the input trees changes
+    key = cache.get_key(
+        locus_key,
+        "SHTEST",
+        *[cache.get_file_key(tree) for tree in [best_tree] + best_constraint_trees]
     )
-    # prep a site likelihood file
-    all_tree_pth, all_tree_map = get_all_merged_trees(
-        working_dir,
-        orig_aln_name,
-        merged_constraint_tree_map,
-        best_tree,
-        merged_constraint_trees
+    cached = {
+        "sitelh": os.path.join(attempt_dir, "RAxML_perSiteLLs.{}.sitelh".format(orig_aln_name))
+    }
+    if not cache.fetch(args.cache, key, cached):
+        # get site likelihoods for every constraint tree, and the best
+        # tree last
+        all_tree_pth = get_all_merged_trees(
+            attempt_dir,
+            orig_aln_name,
+            best_constraint_trees + [best_tree]
+        )
+        get_site_lls_tree_puzzle(
+            attempt_dir,
+            raxml,
+            working_alignment,
+            orig_aln_name,
+            all_tree_pth,
+            get_model_path(attempt_dir, orig_aln_name, args.reuse_model),
+            get_weights(compression)
+        )
+        cache.store(args.cache, key, cached)
+    finish_attempt(working_dir, attempt_dir, "SHTEST", linked)
+    cached = get_kept_files(working_dir, cached)
+    # test the constrained trees against the best tree
+    site_lls = stats.read_site_lls(cached["sitelh"])
+    if compression is not None:
+        # back from site patterns to the columns of the input alignment
+        site_lls = compress.expand_site_lls(site_lls, compression[1])
+    results = get_tree_test_results(
+        site_lls,
+        [os.path.join(working_dir, os.path.basename(tree)) for tree in best_constraint_trees] + [best_tree],
+        args.replicates,
+        cache.get_seed(key)
     )
-    get_site_lls_tree_puzzle(
-        working_dir,
-        raxml,
-        working_alignment,
-        orig_aln_name,
-        all_tree_pth
+    return orig_aln_name, results[:-1], site_lls
+
+
+def get_raxml_command(args, raxml_builds, patterns):
+    """Pick the RAxML build and thread count for a locus.  PTHREADS RAxML
+    splits the likelihood over site patterns, so a locus gets a thread
+    for every --patterns-per-thread patterns, up to --cores."""
+    threads = min(args.cores, patterns // args.patterns_per_thread)
+    if threads < 2 or raxml_builds["pthreads"] is None:
+        return [raxml_builds["serial"]], 1
+    else:
+        return [raxml_builds["pthreads"], "-T", str(threads)], threads
+
+
+def get_locus_jobs(args, raxml_builds, raxml_version, alignment, constraint_strings):
+    """Split a locus into best-ML and constraint searches feeding the SH test"""
+    orig_aln_name, working_dir, working_alignment, compression = stage_locus(args, alignment)
+    # results are cached on the inputs that determine them
+    key_parts = [
+        cache.get_file_key(working_alignment),
+        args.searches,
+        args.seed,
+        raxml_version,
+        args.reuse_model,
+        get_shard_count(args)
+    ]
+    if args.adaptive:
+        key_parts.extend(["adaptive", args.batch_searches, args.tolerance, args.patience, args.max_searches])
+    if compression is not None:
+        key_parts.append(cache.get_file_key(compression[0]))
+    locus_key = cache.get_key(*key_parts)
+    # only the header is read.  a compressed alignment holds only the taxa
+    # with data, and one column per site pattern.
+    ntax, nchar, taxa_present = core.scan_alignment(working_alignment)
+    if compression is None and args.max_memory is not None:
+        # RAxML's memory scales with distinct site patterns, not sites.
+        # only the count is kept, so the planner (and the workers forked
+        # from it) don't hold every alignment.
+        patterns = compress.count_patterns(alignment)
+    else:
+        patterns = nchar
+    # threads are set from the header alone, so a PTHREADS build doesn't
+    # mean reading every alignment up front.  columns are an upper bound
+    # on patterns, and are patterns with --compress.
+    raxml, threads = get_raxml_command(args, raxml_builds, nchar)
+    locus = (args, raxml, orig_aln_name, working_dir, working_alignment, locus_key, taxa_present, compression)
+    # only search once for each distinct effective constraint
+    constraint_map, searches = constraints.get_distinct_constraints(constraint_strings, taxa_present)
+    return make_locus_jobs(args, locus, threads, ntax, nchar, patterns, constraint_map, searches, constraint_strings)
+
+
+def make_locus_jobs(args, locus, threads, ntax, nchar, patterns, constraint_map, searches, constraint_strings):
+    """Make the jobs of a locus: the best-ML search and a search for each
+    name in searches, all feeding the SH test.  constraint_map pairs each
+    constraint with the name of the search standing in for it, or None."""
+    orig_aln_name = locus[2]
+    footprint = memory.get_footprint(ntax, patterns)
+    best_jobs = get_search_jobs(args, locus, None, size=ntax * nchar, footprint=footprint, threads=threads)
+    best_job = best_jobs[-1]
+    constraint_jobs = []
+    search_jobs = {}
+    if args.reuse_model:
+        # constrained searches start from the best-ML model parameters
+        constraint_depends = [best_job.name]
+    else:
+        constraint_depends = []
+    for constraint_name in sorted(searches):
+        jobs = get_search_jobs(
+            args,
+            locus,
+            (constraint_name, constraint_strings[constraint_name]),
+            constraint_depends,
+            ntax * nchar,
+            footprint,
+            threads
+        )
+        search_jobs[constraint_name] = jobs[-1].name
+        constraint_jobs.extend(jobs)
+    constraint_map = [
+        (constraint_name, search_jobs.get(searched_as))
+        for constraint_name, searched_as in constraint_map
+    ]
+    depends = [best_job.name] + sorted(search_jobs.values())
+    sh_job = Job(
+        "{}.SHTEST".format(orig_aln_name),
+        sh_test_job,
+        locus + (best_job.name, constraint_map),
+        depends=depends,
+        locus=orig_aln_name,
+        stage="SHTEST",
+        units=ntax * nchar * (len(constraint_map) + 1),
+        footprint=footprint,
+        threads=threads
     )
-    # go back to cwd we started in
-    os.chdir(owd)
-    # write some progress indicator
-    sys.stdout.write(".")
-    sys.stdout.flush()
-    return sh_test_results
+    return best_jobs + constraint_jobs + [sh_job]
 
 
-def create_results_database(args, log):
-    """Create the results database"""
-    log.info("Creating the SH-test results database")
-    db_pth = os.path.join(args.output, "sh_test_results.sqlite")
-    conn = sqlite3.connect(db_pth)
-    c = conn.cursor()
-    c.execute("PRAGMA foreign_keys = ON")
+def load_config(pth):
+    """Load the YAML config, checking that it maps taxon groups under
+    orders and constraint newicks under constraints"""
+    # yaml and dendropy are slow to import, so they are only imported by
+    # the code that uses them
+    import yaml
+    with open(pth) as infile:
+        config = yaml.safe_load(infile)
+    for section in ("orders", "constraints"):
+        if not isinstance(config, dict) or not isinstance(config.get(section), dict) or not config[section]:
+            raise ValueError("{} has no {} section".format(pth, section))
+    for group_name, taxa in config["orders"].items():
+        if not isinstance(taxa, list) or not taxa:
+            raise ValueError("Group '{}' in {} is not a list of taxa".format(group_name, pth))
+    for constraint_name, newick in config["constraints"].items():
+        if not isinstance(newick, basestring) or newick.count("(") != newick.count(")"):
+            raise ValueError("Constraint '{}' in {} is not a newick tree".format(constraint_name, pth))
+    return config
+
+
+def dry_run(args):
+    """Check the config, the alignments and the overlap of constraint taxa
+    with each alignment, and print the jobs and the predicted cost of the
+    run.  Only alignment headers and constraint labels are read, and
+    nothing is written, so RAxML need not be installed.  Returns an exit
+    status for the shell."""
     try:
-        query = """CREATE TABLE results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            locus text,
-            tree text,
-            ll float,
-            ll_delta float,
-            sd float,
-            worse_five text,
-            worse_two text,
-            worse_one text
-            )
-            """
-        c.execute(query)
-    except sqlite3.OperationalError, e:
-        log.critical("Database already exists")
-        if e[0] == 'table results already exists':
-            answer = raw_input("Database already exists.  Overwrite [Y/n]? ")
-            if answer == "Y" or "YES":
-                os.remove(db_pth)
-                conn, c = create_results_database(args, log)
-            else:
-                sys.exit(2)
+        config = load_config(args.config)
+    except (IOError, ValueError), e:
+        print "[ERROR] {}".format(e)
+        return 1
+    print "Config: {} taxon groups, {} constraints".format(len(config["orders"]), len(config["constraints"]))
+    try:
+        raxml_builds = core.find_raxml_builds()
+    except EnvironmentError:
+        print "RAxML: not found here; assuming the serial build"
+        raxml_builds = {"serial": "raxmlHPC-SSE3", "pthreads": None}
+    # read the header of every alignment
+    alignments = []
+    headers = {}
+    unreadable = 0
+    for alignment in sorted(core.get_alignments(args.alignments)):
+        try:
+            headers[alignment] = core.scan_alignment(alignment)
+            alignments.append(alignment)
+        except ValueError, e:
+            unreadable += 1
+            print "[ERROR] Cannot read {}: {}".format(os.path.basename(alignment), e)
+    group_names, coverage = core.get_taxon_group_coverage(alignments, config["orders"])
+    valid_alignments = []
+    for alignment, groups_present in zip(alignments, coverage):
+        if groups_present.all():
+            valid_alignments.append(alignment)
         else:
-            log.critical("Cannot create database")
-            raise sqlite3.OperationalError("Cannot create database")
-    return conn, c
+            print "Dropped {}: missing taxa from {}".format(
+                os.path.basename(alignment),
+                ", ".join(["'{}'".format(name) for name, ok in zip(group_names, groups_present) if not ok])
+            )
+    print "Alignments: {} of {} usable".format(len(valid_alignments), len(alignments) + unreadable)
+    if args.compress:
+        print "Note: --compress may drop taxa without data, which is not checked here"
+    # a constraint pruned to fewer than four taxa has no bipartitions
+    constraint_taxa = dict([
+        (constraint_name, constraints.get_newick_taxa(newick))
+        for constraint_name, newick in config["constraints"].items()
+    ])
+    all_taxa = frozenset().union(*[headers[alignment][2] for alignment in valid_alignments])
+    constrains = dict([(constraint_name, 0) for constraint_name in constraint_taxa])
+    jobs = []
+    for alignment in valid_alignments:
+        ntax, nchar, taxa_present = headers[alignment]
+        searches = dict([
+            (constraint_name, None)
+            for constraint_name, taxa in constraint_taxa.items()
+            if len(taxa & taxa_present) >= 4
+        ])
+        for constraint_name in searches:
+            constrains[constraint_name] += 1
+        constraint_map = [
+            (constraint_name, constraint_name if constraint_name in searches else None)
+            for constraint_name in sorted(constraint_taxa)
+        ]
+        # without reading the data, every column may be a distinct pattern
+        raxml, threads = get_raxml_command(args, raxml_builds, nchar)
+        orig_aln_name = os.path.splitext(os.path.basename(alignment))[0]
+        locus = (args, raxml, orig_aln_name, None, alignment, None, taxa_present, None)
+        jobs.extend(make_locus_jobs(
+            args,
+            locus,
+            threads,
+            ntax,
+            nchar,
+            nchar,
+            constraint_map,
+            searches,
+            config["constraints"]
+        ))
+    for constraint_name in sorted(constraint_taxa):
+        missing = constraint_taxa[constraint_name] - all_taxa
+        print "Constraint '{}': {} taxa, {} in no usable alignment; constrains {} of {} loci".format(
+            constraint_name,
+            len(constraint_taxa[constraint_name]),
+            len(missing),
+            constrains[constraint_name],
+            len(valid_alignments)
+        )
+    if not valid_alignments:
+        print "[ERROR] There are no alignments to use"
+        return 1
+    costs.set_job_costs(jobs, costs.load_rates(args.history))
+    print "Jobs: at most {} for {} loci (constraints with the same bipartitions at a locus share a search)".format(
+        len(jobs),
+        len(valid_alignments)
+    )
+    print "Predicted cost: {:.0f} CPU seconds, {:.0f} seconds on {} cores".format(
+        sum([job.cost * job.threads for job in jobs]),
+        costs.estimate_makespan(jobs, args.cores),
+        args.cores
+    )
+    return 1 if unreadable else 0
 
 
-def main(args):
-    # setup logging
-    log, my_name = setup_logging(args)
+def plan_run(args, log):
+    """Filter the alignments and split the loci into jobs, creating the
+    results database.  Returns the database connection and cursor, the
+    site-likelihood store, and the jobs."""
     log.info("Getting alignments")
-    # load yaml
-    config = yaml.load(open(args.config))
+    config = load_config(args.config)
     # get raxml
-    raxml = core.which("raxmlHPC-SSE3")
+    raxml_builds = core.find_raxml_builds()
+    raxml_version = core.get_raxml_version(raxml_builds["serial"])
+    log.info("Using RAxML {} at {}".format(raxml_version, raxml_builds["serial"]))
+    if raxml_builds["pthreads"] is not None:
+        log.info("Using {} for loci of {} or more columns".format(
+            raxml_builds["pthreads"],
+            2 * args.patterns_per_thread
+        ))
     # get and check alignments for taxon membership
     alignments = core.get_alignments(args.alignments)
-    valid_alignments = set([])
-    for alignment in alignments:
-        try:
-            if core.satisfy_all_taxon_groups(alignment, config["orders"]):
-                valid_alignments.add(alignment)
-        except core.GroupError, e:
-            if e.message == "Not all taxa present in Group":
-                log.warn("Dropped {} due to missing taxa from '{}'".format(
-                    e.alignment,
-                    e.group
-                ))
-            else:
-                raise core.GroupError(e)
-    # convert remaining alignments to a list
-    valid_alignments = list(valid_alignments)
+    if args.compress:
+        # groups must still be present once taxa without data are dropped
+        for alignment in alignments:
+            taxa, dropped_taxa, patterns, weights, site_map = compress.get_compressed_alignment(alignment)
+            log.info("Compressed {} from {} to {} columns{}".format(
+                os.path.basename(alignment),
+                len(site_map),
+                len(weights),
+                "".join(["; dropped {} (no data)".format(taxon) for taxon in dropped_taxa])
+            ))
+        group_names, coverage = core.get_taxon_group_coverage(
+            alignments,
+            config["orders"],
+            compress.get_taxa_with_data
+        )
+    else:
+        group_names, coverage = core.get_taxon_group_coverage(alignments, config["orders"])
+    valid_alignments = []
+    for alignment, groups_present in zip(alignments, coverage):
+        if groups_present.all():
+            valid_alignments.append(alignment)
+        else:
+            if args.compress:
+                compress.forget_compressed_alignment(alignment)
+            log.warn("Dropped {} due to missing taxa from {}".format(
+                os.path.basename(alignment),
+                ", ".join(["'{}'".format(name) for name, ok in zip(group_names, groups_present) if not ok])
+            ))
+    for group_name, loci_present in zip(group_names, coverage.sum(axis=0)):
+        log.info("Group '{}' present in {} of {} alignments".format(
+            group_name,
+            loci_present,
+            len(alignments)
+        ))
     try:
         assert len(valid_alignments) > 0
     except:
         raise IOError("There are not alignments to use.")
-    # package up alignments with other params
-    work = [(args, raxml, alignment, config["constraints"]) for alignment in alignments]
-    # start run
-    sys.stdout.write("Running")
-    sys.stdout.flush()
-    if args.cores > 1:
-        assert args.cores <= multiprocessing.cpu_count(), "You've specified more cores than you have"
-        pool = multiprocessing.Pool(args.cores)
-        results = pool.map(worker, work)
-        # close the pool.  so sad.
-        pool.close()
-    else:
-        results = map(worker, work)
+    import multiprocessing
+    assert args.cores <= multiprocessing.cpu_count(), "You've specified more cores than you have"
+    # seeds for each search are derived from the run seed
+    if args.seed is None:
+        args.seed = cache.read_seed(args.cache)
+    log.info("Using seed {}".format(args.seed))
+    if args.cache is not None:
+        log.info("Using result cache at {}".format(args.cache))
+    # parse constraint trees once, before the pool forks
+    constraints.load_constraint_trees(config["constraints"])
     # create db to hold results
-    conn, cur = create_results_database(args, log)
-    # enter results to db
-    for locus, sh_tests in results:
-        for sh_test in sh_tests:
-            test_name = os.path.basename(sh_test[0]).split('.')[-3]
-            query = """INSERT INTO results (
-                locus,
-                tree,
-                ll,
-                ll_delta,
-                sd,
-                worse_five,
-                worse_two,
-                worse_one
-                ) VALUES (?,?,?,?,?,?,?,?)"""
-            cur.execute(query, (locus, test_name,) + sh_test[1:])
+    conn, cur = db.create_results_database(args, log)
+    db.insert_constraints(conn, cur, config["constraints"])
+    site_ll_store = sitelh.create_store(conn, cur, args.output, args.site_ll_dtype)
+    # `sh_t work` finds the store from its row, in another process
     conn.commit()
-    cur.close()
-    conn.close()
+    # split each locus into best-ML, constraint, and SH-test jobs
+    jobs = []
+    for alignment in valid_alignments:
+        jobs.extend(get_locus_jobs(args, raxml_builds, raxml_version, alignment, config["constraints"]))
+    log.info("Scheduled {} jobs for {} loci".format(len(jobs), len(valid_alignments)))
+    for job in jobs:
+        job.timeout = args.timeout
+        job.retries = args.retries
+    # predict job run times so the longest loci start first
+    costs.set_job_costs(jobs, costs.load_rates(args.history))
+    log.info("Predicted run time on {} cores: {:.0f} seconds".format(
+        args.cores,
+        costs.estimate_makespan(jobs, args.cores)
+    ))
+    # predict peak memory so --max-memory can limit concurrency
+    memory_ratios = memory.load_ratios(args.history)
+    memory.set_job_memory(jobs, memory_ratios)
+    if args.max_memory is not None:
+        largest = max(jobs, key=lambda job: job.memory)
+        log.info("Limiting jobs to {:.0f} MB; the largest job is predicted to use {:.0f} MB".format(
+            args.max_memory / 1024.,
+            largest.memory / 1024.
+        ))
+        if largest.memory > args.max_memory:
+            log.warn("Jobs predicted to need more than --max-memory will run alone")
+    return conn, cur, site_ll_store, jobs
+
+
+def store_job(args, cur, site_ll_store, job, result):
+    """Do the file work of recording a finished SH test, before any
+    transaction: append its site likelihoods to the store, read its
+    trees, and pack its files.  Returns the (trees, site-likelihood
+    offset, artifacts) that record_job() inserts, or None for other
+    jobs."""
+    if job.stage != "SHTEST":
+        return None
+    locus, sh_tests, site_lls = result
+    working_dir = job.work[3]
+    trees = db.read_trees(
+        [("BEST", os.path.join(working_dir, "RAxML_bestTree.{}.BEST".format(locus)))] +
+        [(name, os.path.join(working_dir, "RAxML_bestTree.{}.{}.constraint.BEST".format(locus, name)))
+            for name, searched_as in job.work[-1]]
+    )
+    offset = sitelh.write_site_lls(cur, site_ll_store, site_lls)
+    # drop the attempt markers, and any copies of jobs that lost to a
+    # faster copy
+    shutil.rmtree(os.path.join(working_dir, ATTEMPTS), ignore_errors=True)
+    if args.pack == "tar":
+        pack_locus_tar(args.output, locus, working_dir)
+        artifacts = None
+    elif args.pack == "db":
+        artifacts = db.read_artifacts(working_dir)
+    else:
+        artifacts = None
+    return trees, offset, artifacts
+
+
+def record_job(cur, job, result, stored):
+    """Insert the results of a finished job into the results database,
+    given what store_job() returned for it.  Nothing is committed, so the
+    rows of a locus can be committed together, with its state in a
+    queue."""
+    db.insert_timing(cur, job)
+    if job.func is search_job:
+        db.insert_search(cur, job.locus, job.work[-2], result[1])
+    if job.stage == "SHTEST":
+        locus, sh_tests, site_lls = result
+        trees, offset, artifacts = stored
+        db.insert_constraint_searches(cur, locus, job.work[-1])
+        db.insert_trees(cur, locus, trees)
+        sitelh.index_site_lls(
+            cur,
+            locus,
+            [name for name, searched_as in job.work[-1]] + ["BEST"],
+            offset,
+            site_lls.shape[1]
+        )
+        if artifacts is not None:
+            db.insert_artifacts(cur, locus, artifacts)
+        db.insert_sh_test_results(cur, locus, sh_tests)
+
+
+def finish_job(args, job):
+    """Once the results of an SH test are committed, move its locus out
+    of --scratch or remove its packed files"""
+    if job.stage == "SHTEST":
+        finish_locus(args, job.locus, job.work[3])
+
+
+def compare_trees(conn, cur, log, cores=1):
+    """Compare the best and constrained trees of every finished locus not
+    yet compared, on up to `cores` processes, and record the results"""
+    loci = sorted(db.get_uncompared_trees(cur).items())
+    if not loci:
+        return 0
+    start = time.time()
+    cur.execute("SELECT name, newick FROM constraints")
+    constraint_strings = dict(cur.fetchall())
+    if cores > 1 and len(loci) > 1:
+        import multiprocessing
+        chunk = len(loci) // cores + 1
+        pool = multiprocessing.Pool(cores)
+        try:
+            results = [
+                pool.apply_async(bipartitions.compare_loci, (loci[i:i + chunk], constraint_strings))
+                for i in xrange(0, len(loci), chunk)
+            ]
+            rows = [row for result in results for row in result.get(1e6)]
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        rows = bipartitions.compare_loci(loci, constraint_strings)
+    db.insert_tree_comparisons(conn, cur, rows)
+    log.info("Compared the trees of {} loci in {:.1f} seconds".format(len(loci), time.time() - start))
+    return len(loci)
+
+
+def main(args):
+    # setup logging
+    log, my_name = setup_logging(args)
+    conn, cur, site_ll_store, jobs = plan_run(args, log)
+    memory_ratios = memory.load_ratios(args.history)
+    # start run
+    # only draw the progress line on a terminal
+    tracker = progress.Progress(
+        jobs,
+        os.path.join(args.output, progress.STATUS_NAME),
+        sys.stdout if sys.stdout.isatty() else None
+    )
+    log.info("Writing run status to {}".format(tracker.status_pth))
+    try:
+        # results go to the db as each locus finishes
+        for job, result in run_jobs(
+                jobs,
+                args.cores,
+                args.runner,
+                args.max_memory,
+                args.speculate,
+                progress=tracker.update):
+            if job.error is not None:
+                # the rest of the locus is dropped, but the run goes on
+                tracker.clear()
+                log.error("Job {} failed after {} attempts:\n{}".format(job.name, job.attempts, job.error))
+                db.insert_failure(cur, job)
+                conn.commit()
+                continue
+            memory.observe(jobs, memory_ratios, job)
+            record_job(cur, job, result, store_job(args, cur, site_ll_store, job, result))
+            if job.stage == "SHTEST":
+                # commit per locus so finished loci survive a crash
+                conn.commit()
+                finish_job(args, job)
+        tracker.finish()
+        compare_trees(conn, cur, log, args.cores)
+    finally:
+        cur.close()
+        conn.close()
+    if tracker.loci_failed:
+        log.warn("Skipped {} loci with failed jobs: {}".format(
+            len(tracker.loci_failed),
+            ", ".join(sorted(tracker.loci_failed))
+        ))
     # ----------------------
     # end
     text = " Completed {} ".format(my_name)
     log.info(text.center(65, "="))
 
+
+def plan(args):
+    """Put the jobs of a run in a queue in the results database, for
+    `sh_t work` processes to run"""
+    log, my_name = setup_logging(args)
+    if args.scratch is not None:
+        raise ValueError("--scratch is local to one host, so it can't be used with a queue")
+    conn, cur, site_ll_store, jobs = plan_run(args, log)
+    cur.close()
+    conn.close()
+    conn = jobqueue.connect(os.path.join(args.output, "sh_test_results.sqlite"))
+    try:
+        # WAL needs memory shared between the processes using the database,
+        # which hosts on a network filesystem don't have
+        conn.execute("PRAGMA journal_mode = DELETE")
+        jobqueue.create_queue(conn)
+        jobqueue.enqueue_jobs(conn, jobs)
+    finally:
+        conn.close()
+    log.info("Queued {} jobs in {}".format(len(jobs), args.output))
+    text = " Completed {} ".format(my_name)
+    log.info(text.center(65, "="))
+
+
+def work(args):
+    """Run queued jobs until none are ready or running"""
+    log, my_name = setup_logging(args)
+    db_pth = os.path.join(args.output, "sh_test_results.sqlite")
+    conn = jobqueue.connect(db_pth)
+    cur = conn.cursor()
+    site_ll_store = sitelh.open_store(cur, args.output)
+    try:
+        # each job was planned with the run's arguments
+        done, failed = jobqueue.run_worker(
+            conn,
+            db_pth,
+            args.worker,
+            args.lease,
+            args.poll,
+            store=lambda job, result: store_job(job.work[0], cur, site_ll_store, job, result),
+            record=lambda job, result, stored: record_job(cur, job, result, stored),
+            finish=lambda job: finish_job(job.work[0], job),
+            record_failure=lambda job: db.insert_failure(cur, job),
+            log=log
+        )
+        # loci finished by other workers are compared when they stop
+        compare_trees(conn, cur, log)
+    finally:
+        cur.close()
+        conn.close()
+    log.info("Ran {} jobs".format(done))
+    if failed:
+        log.warn("{} jobs failed after their retries".format(failed))
+    text = " Completed {} ".format(my_name)
+    log.info(text.center(65, "="))
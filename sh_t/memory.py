@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 23:10 PDT (-0700)
+
+Predict the peak memory of RAxML jobs so the scheduler can keep a run
+inside --max-memory.
+"""
+
+
+import re
+import sqlite3
+
+#import pdb
+
+
+# GTRGAMMA on DNA holds a likelihood vector of states x rate categories
+# doubles per site pattern at each of the ntax - 2 inner nodes
+STATES = 4
+RATE_CATEGORIES = 4
+# resident size of RAxML before any likelihood vectors are allocated
+BASE_KB = 16 * 1024
+
+
+def parse_memory(value):
+    """Parse a size such as 512M, 16G or 1T (plain numbers are MB) into KB"""
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", value, re.IGNORECASE)
+    if not match:
+        raise ValueError("Cannot parse memory size {}".format(value))
+    number, unit = match.groups()
+    scale = {"K": 1, "": 1024, "M": 1024, "G": 1024 ** 2, "T": 1024 ** 3}[unit.upper()]
+    return float(number) * scale
+
+
+def get_footprint(ntax, patterns):
+    """Size in KB of the likelihood vectors RAxML allocates for a locus"""
+    return max(ntax - 2, 1) * patterns * STATES * RATE_CATEGORIES * 8 / 1024.
+
+
+def load_ratios(databases):
+    """Learn, for each stage, the largest ratio of measured peak RSS
+    (less BASE_KB) to footprint from earlier runs"""
+    ratios = {}
+    for db_pth in databases or []:
+        conn = sqlite3.connect(db_pth)
+        try:
+            rows = conn.execute("""SELECT j.stage, j.footprint, MAX(t.maxrss_kb)
+                FROM job_timings j JOIN timings t ON t.locus = j.locus AND t.job = j.job
+                WHERE j.footprint > 0 GROUP BY j.id""").fetchall()
+        except sqlite3.OperationalError:
+            # no memory use in this database
+            rows = []
+        finally:
+            conn.close()
+        for stage, footprint, maxrss_kb in rows:
+            update_ratio(ratios, stage, footprint, maxrss_kb)
+    return ratios
+
+
+def update_ratio(ratios, stage, footprint, maxrss_kb):
+    """Raise the ratio for a stage to cover a measured peak RSS.  Returns
+    True when the ratio changed."""
+    if not footprint or maxrss_kb is None:
+        return False
+    ratio = max(maxrss_kb - BASE_KB, 0.) / footprint
+    if ratio > ratios.get(stage, 1.):
+        ratios[stage] = ratio
+        return True
+    return False
+
+
+def set_job_memory(jobs, ratios):
+    """Set the predicted peak memory (KB) of each job from its footprint"""
+    for job in jobs:
+        job.memory = BASE_KB + job.footprint * ratios.get(job.stage, 1.)
+    return jobs
+
+
+def observe(jobs, ratios, job):
+    """Refine the predictions for every job from the measured peak RSS of
+    one that finished"""
+    peaks = [record.maxrss_kb for record in job.records if record.maxrss_kb is not None]
+    if peaks and update_ratio(ratios, job.stage, job.footprint, max(peaks)):
+        set_job_memory([other for other in jobs if other.stage == job.stage], ratios)
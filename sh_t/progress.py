@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 19 October 2026 14:40 PDT (-0700)
+
+Follow a run from the job events the scheduler sends.  Shows a live
+progress line and keeps a JSON status file in the output dir for
+outside monitoring.
+"""
+
+
+import os
+import json
+import time
+
+#import pdb
+
+
+STATUS_NAME = "status.json"
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "{}h{:02d}m".format(seconds // 3600, seconds % 3600 // 60)
+    else:
+        return "{}m{:02d}s".format(seconds // 60, seconds % 60)
+
+
+def write_json(pth, data):
+    """Replace pth with data as JSON, so readers never see a partial file"""
+    temp = "{}.tmp".format(pth)
+    with open(temp, 'w') as outfile:
+        json.dump(data, outfile, indent=2, sort_keys=True)
+    os.rename(temp, pth)
+
+
+class Progress(object):
+    """Counts of finished, running and failed jobs and loci, kept up to date
+    by passing update() to run_jobs() as its progress function.
+
+    The progress line goes to stream (None for no line) and the status
+    file to status_pth (None for no file), at most every interval seconds
+    except when a job fails."""
+    def __init__(self, jobs, status_pth=None, stream=None, interval=1.):
+        self.jobs = dict([(job.name, job) for job in jobs])
+        self.status_pth = status_pth
+        self.stream = stream
+        self.interval = interval
+        self.started = time.time()
+        self.shown = 0.
+        # running copies of jobs, keyed on (job, attempt)
+        self.running = {}
+        self.done = set()
+        self.failed = set()
+        self.retries = 0
+        self.left = {}
+        for job in jobs:
+            self.left[job.locus] = self.left.get(job.locus, 0) + 1
+        self.loci_done = set()
+        self.loci_failed = set()
+        # cost of the finished jobs, as a share of the run
+        self.total_cost = sum([job.cost for job in jobs])
+        self.done_cost = 0.
+        # finished jobs and their total seconds, by stage
+        self.stages = {}
+
+    def update(self, event):
+        kind = event["event"]
+        key = (event.get("job"), event.get("attempt"))
+        if kind == "start":
+            if event["job"] not in self.done and event["job"] not in self.failed:
+                self.running[key] = event
+        elif kind != "tick":
+            self.running.pop(key, None)
+        if kind == "retry":
+            self.retries += 1
+        elif kind in ("done", "failed"):
+            job = self.jobs[event["job"]]
+            if kind == "done":
+                self.done.add(job.name)
+                self.done_cost += job.cost
+                count, seconds = self.stages.get(job.stage, (0, 0.))
+                self.stages[job.stage] = (count + 1, seconds + event["duration"])
+                self.left[job.locus] -= 1
+                if not self.left[job.locus] and job.locus not in self.loci_failed:
+                    self.loci_done.add(job.locus)
+            else:
+                self.failed.add(job.name)
+                self.loci_failed.add(job.locus)
+        self.show(event["time"], kind == "failed")
+
+    def get_eta(self, now):
+        """Predict the seconds left from the share of the predicted cost
+        already done, or from the loci finished when there are no costs"""
+        elapsed = now - self.started
+        if self.total_cost > 0:
+            fraction = self.done_cost / self.total_cost
+        else:
+            fraction = float(len(self.loci_done) + len(self.loci_failed)) / max(len(self.left), 1)
+        if fraction <= 0:
+            return None
+        return max(elapsed * (1 - fraction) / fraction, 0.)
+
+    def get_status(self, now=None):
+        if now is None:
+            now = time.time()
+        elapsed = now - self.started
+        hours = max(elapsed, 1.) / 3600.
+        return {
+            "started": self.started,
+            "updated": now,
+            "elapsed": elapsed,
+            "eta": self.get_eta(now),
+            "jobs": {
+                "total": len(self.jobs),
+                "done": len(self.done),
+                "running": len(set([name for name, attempt in self.running])),
+                "failed": len(self.failed),
+                "retries": self.retries
+            },
+            "loci": {
+                "total": len(self.left),
+                "done": len(self.loci_done),
+                "failed": len(self.loci_failed),
+                "per_hour": len(self.loci_done) / hours
+            },
+            "stages": dict([
+                (stage, {"done": count, "mean_seconds": seconds / count, "per_hour": count / hours})
+                for stage, (count, seconds) in self.stages.items()
+            ]),
+            "running": [
+                {
+                    "job": name,
+                    "attempt": attempt,
+                    "locus": self.jobs[name].locus,
+                    "stage": self.jobs[name].stage,
+                    "pid": event["pid"],
+                    "seconds": now - event["time"]
+                }
+                for (name, attempt), event in sorted(self.running.items())
+            ]
+        }
+
+    def get_line(self, status):
+        return "{}/{} loci, {} failed | jobs {} done, {} running, {} failed | {:.1f} loci/h | ETA {}".format(
+            status["loci"]["done"],
+            status["loci"]["total"],
+            status["loci"]["failed"],
+            status["jobs"]["done"],
+            status["jobs"]["running"],
+            status["jobs"]["failed"],
+            status["loci"]["per_hour"],
+            format_duration(status["eta"])
+        )
+
+    def show(self, now, force=False):
+        if not force and now - self.shown < self.interval:
+            return
+        self.shown = now
+        status = self.get_status(now)
+        if self.status_pth is not None:
+            write_json(self.status_pth, status)
+        if self.stream is not None:
+            # redraw the line in place
+            self.stream.write("\r{}\x1b[K".format(self.get_line(status)))
+            self.stream.flush()
+
+    def clear(self):
+        """Clear the progress line, e.g. before logging"""
+        if self.stream is not None:
+            self.stream.write("\r\x1b[K")
+            self.stream.flush()
+
+    def finish(self):
+        """Write the final status and end the progress line"""
+        self.show(time.time(), True)
+        if self.stream is not None:
+            self.stream.write("\n")
+            self.stream.flush()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 09:12 PDT (-0700)
+"""
+
+
+import os
+import time
+import threading
+import traceback
+import Queue
+
+from sh_t import commands
+
+#import pdb
+
+
+# the attempt of the job running on each thread
+_local = threading.local()
+# where run_job reports that a job has started, set in each process of a
+# pool
+_events = None
+
+
+class Job(object):
+    """A unit of work and the names of the jobs it depends upon"""
+    def __init__(self, name, func, work, depends=(), locus=None, stage=None, units=0., footprint=0., threads=1):
+        self.name = name
+        self.func = func
+        self.work = work
+        self.depends = list(depends)
+        self.locus = locus
+        self.stage = stage
+        # the size of the job, and its predicted run time in seconds
+        self.units = units
+        self.cost = 0.
+        # the modelled memory of the job, and its predicted peak in KB
+        self.footprint = footprint
+        self.memory = 0.
+        # the cores the job keeps busy
+        self.threads = threads
+        # seconds each command may run, and the times to re-run the job
+        # after it fails
+        self.timeout = None
+        self.retries = 0
+        self.attempts = 0
+        self.started = None
+        self.finished = None
+        self.records = []
+        self.error = None
+
+    def __repr__(self):
+        return "<Job {}>".format(self.name)
+
+
+def get_attempt():
+    """Get the attempt of the job running on this thread: 0 for the first
+    run of a job, and above that for retries and duplicates, which
+    should use new seeds"""
+    return getattr(_local, "attempt", 0)
+
+
+def set_events(events):
+    """Send job events to a queue (None to stop sending them)"""
+    global _events
+    _events = events
+
+
+def run_job(name, func, work, upstream, attempt=0, timeout=None):
+    """Run a job, trapping errors so they can be passed back to the parent
+    along with the resource use of the commands the job ran"""
+    if _events is not None:
+        _events.put({
+            "event": "start",
+            "job": name,
+            "attempt": attempt,
+            "time": time.time(),
+            "pid": os.getpid()
+        })
+    _local.attempt = attempt
+    commands.set_timeout(timeout)
+    try:
+        return name, attempt, func(work, upstream), None, commands.drain()
+    except:
+        return name, attempt, None, traceback.format_exc(), commands.drain()
+
+
+def check_jobs(jobs):
+    names = set([job.name for job in jobs])
+    if len(names) != len(jobs):
+        raise ValueError("Job names are not unique")
+    for job in jobs:
+        for dep in job.depends:
+            if dep not in names:
+                raise ValueError("{} depends on unknown job {}".format(job.name, dep))
+
+
+def get_dependents(jobs):
+    dependents = dict([(job.name, []) for job in jobs])
+    for job in jobs:
+        for dep in job.depends:
+            dependents[dep].append(job.name)
+    return dependents
+
+
+def get_priorities(jobs):
+    """Get the predicted time from the start of each job to the end of
+    the longest chain of jobs that waits on it"""
+    by_name = dict([(job.name, job) for job in jobs])
+    dependents = get_dependents(jobs)
+    priorities = {}
+    for job in jobs:
+        # walk down the graph without recursion
+        stack = [job.name]
+        while stack:
+            name = stack[-1]
+            if name in priorities:
+                stack.pop()
+                continue
+            todo = [child for child in dependents[name] if child not in priorities]
+            if todo:
+                stack.extend(todo)
+            else:
+                stack.pop()
+                priorities[name] = by_name[name].cost + max(
+                    [priorities[child] for child in dependents[name]] or [0.]
+                )
+    return priorities
+
+
+def run_jobs(jobs, cores=1, runner="processes", max_memory=None, speculate=None, poll=1., progress=None):
+    """Run a graph of jobs on at most `cores` processes, or threads when
+    runner is "threads".
+
+    Jobs are started as soon as all of their dependencies have finished,
+    so independent jobs from every locus share one pool, in order of the
+    predicted time left on their longest chain of dependents.  A job
+    only starts while the threads of the running jobs leave room for
+    its own within `cores`, and, with max_memory (KB), while their
+    predicted memory leaves room for it.  Smaller ready jobs fill the
+    gap, and a job too big for either limit runs alone.
+
+    A job that fails is run again up to job.retries times.  If it still
+    fails it is yielded with a result of None and its traceback in
+    job.error, and the jobs that depend on it never run, so the rest of
+    the graph carries on.  With speculate, whenever no job is waiting to
+    start, a second copy is started of any job that has been running
+    for speculate times its predicted cost; the first copy to finish is
+    kept.  Running copies are checked every poll seconds.
+
+    With progress, a function, it is passed a dict for every event: a
+    job "start"ing (sent by the process running it), and a copy of a job
+    finishing as "done", "retry" (it failed, but will run again or
+    another copy is running), "failed" (for good) or "dropped" (a faster
+    copy finished first).  Every event has the job, attempt and time.
+    Finishing events add the duration.  A "tick" event with just the
+    time comes every poll seconds.  Yields (job, result) tuples in the
+    order jobs finish.
+    """
+    # pools are only needed to run jobs, not to plan them
+    import multiprocessing
+    import multiprocessing.pool
+    check_jobs(jobs)
+    jobs = list(jobs)
+    by_name = dict([(job.name, job) for job in jobs])
+    waiting_on = dict([(job.name, set(job.depends)) for job in jobs])
+    dependents = get_dependents(jobs)
+    # start the jobs heading the longest chains first, so big loci don't
+    # finish last.  ties keep submission order.
+    priorities = get_priorities(jobs)
+    order = dict([(job.name, cnt) for cnt, job in enumerate(jobs)])
+    ready = [job.name for job in jobs if not job.depends]
+    results = {}
+    finished = Queue.Queue()
+    # threads and predicted memory of each running copy of a job, keyed
+    # on (name, attempt), as they were when the copy started
+    in_use = {}
+    started = {}
+    failures = dict([(job.name, 0) for job in jobs])
+    speculated = set()
+    done = set()
+    if progress is None:
+        events = None
+    elif cores > 1 and runner != "threads":
+        events = multiprocessing.Queue()
+    else:
+        events = Queue.Queue()
+    if cores > 1 and runner == "threads":
+        # jobs spend their time waiting on RAxML, so threads in one
+        # parent can keep the cores busy
+        set_events(events)
+        pool = multiprocessing.pool.ThreadPool(cores)
+    elif cores > 1:
+        pool = multiprocessing.Pool(cores, set_events, (events,))
+    else:
+        set_events(events)
+        pool = None
+    # copies can only overlap with a pool
+    speculating = speculate is not None and pool is not None
+    if speculating or progress is not None:
+        wait = poll
+    else:
+        # a timeout lets KeyboardInterrupt through on python 2
+        wait = 1e6
+
+    def fits(job):
+        if not in_use:
+            return True
+        threads, memory = [sum(i) for i in zip(*in_use.values())]
+        if threads + job.threads > cores:
+            return False
+        if max_memory is not None and memory + job.memory > max_memory:
+            return False
+        return True
+
+    def start(job):
+        attempt = job.attempts
+        job.attempts += 1
+        in_use[(job.name, attempt)] = (job.threads, job.memory)
+        started[(job.name, attempt)] = time.time()
+        work = (
+            job.name,
+            job.func,
+            job.work,
+            dict([(dep, results[dep]) for dep in job.depends]),
+            attempt,
+            job.timeout
+        )
+        if pool is not None:
+            pool.apply_async(run_job, work, callback=finished.put)
+        else:
+            finished.put(run_job(*work))
+
+    try:
+        while ready or in_use:
+            ready.sort(key=lambda name: (-priorities[name], order[name]))
+            for name in list(ready):
+                if fits(by_name[name]):
+                    ready.remove(name)
+                    start(by_name[name])
+            if speculating and not ready:
+                # duplicate the stragglers, longest running first
+                now = time.time()
+                for (name, attempt), begun in sorted(started.items(), key=lambda item: item[1]):
+                    job = by_name[name]
+                    if name in speculated or job.cost <= 0 or now - begun < speculate * job.cost:
+                        continue
+                    if fits(job):
+                        speculated.add(name)
+                        start(job)
+            try:
+                name, attempt, result, error, records = finished.get(True, wait)
+            except Queue.Empty:
+                name = None
+            if progress is not None:
+                # start events from the pool, then the time
+                while True:
+                    try:
+                        progress(events.get_nowait())
+                    except Queue.Empty:
+                        break
+                progress({"event": "tick", "time": time.time()})
+            if name is None:
+                continue
+            in_use.pop((name, attempt))
+            begun = started.pop((name, attempt))
+            job = by_name[name]
+            if name in done:
+                # the slower copy of a job that has already finished
+                report(progress, "dropped", name, attempt, begun)
+                continue
+            if error is not None:
+                failures[name] += 1
+                if any([key[0] == name for key in in_use]):
+                    # another copy may yet succeed
+                    report(progress, "retry", name, attempt, begun)
+                    continue
+                if failures[name] <= job.retries:
+                    report(progress, "retry", name, attempt, begun)
+                    ready.append(name)
+                    continue
+            report(progress, "done" if error is None else "failed", name, attempt, begun)
+            done.add(name)
+            job.started = begun
+            job.finished = time.time()
+            job.records = records
+            job.error = error
+            if error is None:
+                if dependents[name]:
+                    results[name] = result
+                for child in dependents[name]:
+                    waiting_on[child].discard(name)
+                    if not waiting_on[child]:
+                        ready.append(child)
+            # drop results nothing else needs
+            for dep in job.depends:
+                if all([d in done for d in dependents[dep]]):
+                    results.pop(dep, None)
+            yield job, result
+    finally:
+        set_events(None)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+def report(progress, event, name, attempt, started):
+    """Pass a job finishing to progress, when there is one"""
+    if progress is not None:
+        now = time.time()
+        progress({
+            "event": event,
+            "job": name,
+            "attempt": attempt,
+            "time": now,
+            "duration": now - started
+        })
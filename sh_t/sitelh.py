@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 21:24 PDT (-0700)
+
+A single binary store of per-site log-likelihoods for every locus.  Each
+locus is appended as a trees x sites block to one flat array on disk,
+and the results database indexes the offset of every tree's row, so
+loci can be read back as slices of a memory map.
+"""
+
+
+import os
+import fcntl
+import sqlite3
+
+# numpy is imported when site likelihoods are stored or read
+
+#import pdb
+
+
+STORE_NAME = "site_lls.bin"
+
+
+def create_store(conn, cur, output, dtype="float64"):
+    """Create an empty store next to the results database, record its
+    name (relative to the output dir) and dtype there, and return its
+    path"""
+    import numpy
+    cur.execute(
+        "INSERT INTO site_ll_store (pth, dtype) VALUES (?,?)",
+        (STORE_NAME, numpy.dtype(dtype).name)
+    )
+    pth = os.path.join(output, STORE_NAME)
+    open(pth, 'wb').close()
+    return pth
+
+
+def open_store(cur, output):
+    """Get the path of an existing store, to append to it"""
+    pth = cur.execute("SELECT pth FROM site_ll_store").fetchone()[0]
+    return os.path.join(output, pth)
+
+
+def write_site_lls(cur, store, site_lls):
+    """Append the trees x sites array of a locus to the store at path
+    store, and return the offset of its first value.  Nothing points to
+    the data until index_site_lls() is called with the offset.
+
+    Processes on other hosts may share the store over a network
+    filesystem, so each append reopens the file and holds a lock on it
+    while it finds the end and writes there, and the data is on disk
+    before the index can point to it."""
+    import numpy
+    dtype = numpy.dtype(cur.execute("SELECT dtype FROM site_ll_store").fetchone()[0])
+    with open(store, 'r+b') as outfile:
+        # taking the lock also makes NFS clients drop their cached size
+        fcntl.lockf(outfile, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(outfile.fileno()).st_size
+            outfile.seek(size)
+            outfile.write(numpy.ascontiguousarray(site_lls, dtype=dtype).tostring())
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        finally:
+            fcntl.lockf(outfile, fcntl.LOCK_UN)
+    return size // dtype.itemsize
+
+
+def index_site_lls(cur, locus, trees, offset, nsites):
+    """Index the rows of a locus written at offset by write_site_lls().
+    The index rows are committed with the locus results."""
+    query = """INSERT INTO site_lls (
+        locus,
+        tree,
+        offset,
+        nsites
+        ) VALUES (?,?,?,?)"""
+    cur.executemany(query, [
+        (locus, tree, offset + cnt * nsites, nsites)
+        for cnt, tree in enumerate(trees)
+    ])
+
+
+def load_store(db_pth):
+    """Memory-map the store of a results database.  Returns the flat array
+    and an index of {locus: [(tree, offset, nsites), ...]}."""
+    import numpy
+    conn = sqlite3.connect(db_pth)
+    try:
+        pth, dtype = conn.execute("SELECT pth, dtype FROM site_ll_store").fetchone()
+        index = {}
+        for locus, tree, offset, nsites in conn.execute(
+                "SELECT locus, tree, offset, nsites FROM site_lls ORDER BY id"):
+            index.setdefault(locus, []).append((tree, offset, nsites))
+    finally:
+        conn.close()
+    pth = os.path.join(os.path.dirname(db_pth), pth)
+    if os.path.getsize(pth) == 0:
+        # numpy cannot map an empty file
+        data = numpy.zeros(0, dtype=dtype)
+    else:
+        data = numpy.memmap(pth, dtype=dtype, mode='r')
+    return data, index
+
+
+def get_locus_site_lls(data, index, locus):
+    """Get the tree names and a trees x sites view of one locus"""
+    rows = index[locus]
+    trees = [tree for tree, offset, nsites in rows]
+    offset, nsites = rows[0][1], rows[0][2]
+    return trees, data[offset:offset + len(rows) * nsites].reshape(len(rows), nsites)
+
+
+def get_tree_site_lls(data, index, locus, tree):
+    """Get a view of the site likelihoods of one tree at one locus"""
+    for name, offset, nsites in index[locus]:
+        if name == tree:
+            return data[offset:offset + nsites]
+    raise KeyError("{} has no tree {}".format(locus, tree))
+
+
+def concatenate_site_lls(data, index, trees, loci=None):
+    """Join the site likelihoods of the named trees across loci into one
+    trees x sites array, e.g. to test trees on the concatenated data.
+    Loci lacking any of the trees are skipped."""
+    import numpy
+    if loci is None:
+        loci = sorted(index)
+    blocks = []
+    for locus in loci:
+        names = [name for name, offset, nsites in index[locus]]
+        if all([tree in names for tree in trees]):
+            blocks.append(numpy.vstack([get_tree_site_lls(data, index, locus, tree) for tree in trees]))
+    if not blocks:
+        return numpy.zeros((len(trees), 0), dtype=data.dtype)
+    return numpy.hstack(blocks)
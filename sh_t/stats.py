@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+(c) 2014 Brant Faircloth || http://faircloth-lab.org/
+All rights reserved.
+
+This code is distributed under a 3-clause BSD license. Please see
+LICENSE.txt for more information.
+
+Created on 18 October 2026 20:36 PDT (-0700)
+
+Tree selection tests (KH, SH, ELW and AU) from per-site log-likelihoods,
+using RELL bootstrap replicates drawn in batches.
+"""
+
+
+import math
+
+# numpy is imported where it is used, so planning a run doesn't wait on it
+
+#import pdb
+
+
+# the multiscale bootstrap scales used by CONSEL for the AU test
+AU_SCALES = (0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3, 1.4)
+
+
+def read_site_lls(pth):
+    """Read a RAxML_perSiteLLs (TREE-PUZZLE format) file into a trees x
+    sites array"""
+    import numpy
+    with open(pth, 'rU') as infile:
+        ntrees, nsites = [int(i) for i in infile.readline().split()[:2]]
+        tokens = infile.read().split()
+    if len(tokens) != ntrees * (nsites + 1):
+        raise ValueError("Expected {} trees of {} sites in {}".format(ntrees, nsites, pth))
+    # every tree row is a label followed by its site likelihoods
+    rows = numpy.array(tokens).reshape(ntrees, nsites + 1)
+    return rows[:, 1:].astype(numpy.float64)
+
+
+def norm_cdf(x):
+    return 0.5 * (1. + math.erf(x / math.sqrt(2.)))
+
+
+def norm_ppf(p):
+    """Inverse of the standard normal CDF (Acklam's approximation, with
+    one Newton step)"""
+    if p <= 0.:
+        return float("-inf")
+    if p >= 1.:
+        return float("inf")
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00)
+    if p < 0.02425:
+        q = math.sqrt(-2. * math.log(p))
+        x = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.)
+    elif p > 1. - 0.02425:
+        q = math.sqrt(-2. * math.log(1. - p))
+        x = -(((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.)
+    else:
+        q = p - 0.5
+        r = q * q
+        x = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+            (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1.)
+    # refine
+    e = norm_cdf(x) - p
+    return x - e * math.sqrt(2. * math.pi) * math.exp(x * x / 2.)
+
+
+def rell_replicates(site_lls, replicates, rng, scale=1.0, batch_cells=5000000):
+    """Yield batches of bootstrap tree log-likelihoods (replicates x trees).
+
+    Each replicate resamples round(scale x sites) sites with replacement;
+    RELL sums the fixed site likelihoods over the resampled sites rather
+    than re-optimizing the trees.  Batches are sized to hold about
+    batch_cells resampled sites."""
+    import numpy
+    ntrees, nsites = site_lls.shape
+    draws = max(1, int(round(scale * nsites)))
+    batch = max(1, min(replicates, batch_cells // draws))
+    done = 0
+    while done < replicates:
+        size = min(batch, replicates - done)
+        # count how often each site is drawn in each replicate
+        picks = rng.randint(0, nsites, size=(size, draws))
+        picks += (numpy.arange(size) * nsites)[:, None]
+        counts = numpy.bincount(picks.ravel(), minlength=size * nsites).reshape(size, nsites)
+        yield counts.dot(site_lls.T)
+        done += size
+
+
+def tree_tests(site_lls, replicates=1000, seed=None, scales=AU_SCALES):
+    """Run the KH, SH, ELW and AU tests on a trees x sites array.
+
+    KH compares each tree with the best tree in the set, SH tests each
+    tree against the whole set, ELW gives expected likelihood weights,
+    and AU uses a multiscale bootstrap.  Returns a dict of arrays, one
+    value per tree."""
+    import numpy
+    rng = numpy.random.RandomState(seed)
+    ntrees, nsites = site_lls.shape
+    lls = site_lls.sum(axis=1)
+    best = lls.argmax()
+    deltas = lls[best] - lls
+    # SD of the difference in likelihood to the best tree
+    site_deltas = site_lls[best] - site_lls
+    sd = numpy.sqrt(nsites * site_deltas.var(axis=1, ddof=1)) if nsites > 1 else numpy.zeros(ntrees)
+    # RELL at scale 1 for KH, SH and ELW
+    boot = numpy.vstack(list(rell_replicates(site_lls, replicates, rng)))
+    centered = boot - boot.mean(axis=0)
+    kh = ((centered[:, [best]] - centered) >= deltas).mean(axis=0)
+    kh[best] = 1.
+    sh = ((centered.max(axis=1)[:, None] - centered) >= deltas).mean(axis=0)
+    weights = numpy.exp(boot - boot.max(axis=1)[:, None])
+    elw = (weights / weights.sum(axis=1)[:, None]).mean(axis=0)
+    au = au_test(site_lls, replicates, rng, scales)
+    return {
+        "ll": lls,
+        "delta": -deltas,
+        "sd": sd,
+        "kh": kh,
+        "sh": sh,
+        "elw": elw,
+        "au": au
+    }
+
+
+def au_test(site_lls, replicates, rng, scales=AU_SCALES):
+    """Approximately unbiased test (Shimodaira 2002).
+
+    For each scale r the bootstrap probability BP(r) that a tree has the
+    highest likelihood is estimated from replicates of r x sites.  The
+    normalized z-values are fit to z(r) sqrt(r) = v r + c by weighted
+    least squares, and the AU p-value is 1 - Phi(v - c)."""
+    import numpy
+    ntrees, nsites = site_lls.shape
+    bps = numpy.zeros((len(scales), ntrees))
+    for k, scale in enumerate(scales):
+        wins = numpy.zeros(ntrees)
+        for boot in rell_replicates(site_lls, replicates, rng, scale):
+            wins += numpy.bincount(boot.argmax(axis=1), minlength=ntrees)
+        bps[k] = wins / replicates
+    au = numpy.zeros(ntrees)
+    r = numpy.array(scales)
+    for tree in xrange(ntrees):
+        bp = bps[:, tree]
+        usable = (bp > 0) & (bp < 1)
+        if usable.sum() < 2:
+            # the tree always, or never, wins
+            au[tree] = bp.mean()
+            continue
+        z = numpy.array([norm_ppf(1. - p) for p in bp[usable]])
+        y = z * numpy.sqrt(r[usable])
+        # binomial variance of BP carried through to y
+        density = numpy.exp(-z * z / 2.) / math.sqrt(2. * math.pi)
+        var = bp[usable] * (1. - bp[usable]) / (replicates * density * density) * r[usable]
+        w = 1. / var
+        design = numpy.vstack([r[usable], numpy.ones(usable.sum())]).T
+        wd = design * w[:, None]
+        v, c = numpy.linalg.solve(design.T.dot(wd), wd.T.dot(y))
+        au[tree] = 1. - norm_cdf(v - c)
+    return au
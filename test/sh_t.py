@@ -12,8 +12,31 @@ Created on 21 April 2014 21:16 PDT (-0700)
 """
 
 import os
+import json
 import pytest
+import sqlite3
+import logging
+import argparse
+import tarfile
+import time
+import multiprocessing
+import numpy
+from sh_t import db
+from sh_t import cache
 from sh_t import core
+from sh_t import constraints
+from sh_t import costs
+from sh_t import memory
+from sh_t import jobqueue
+from sh_t import commands
+from sh_t import compress
+from sh_t import stats
+from sh_t import sitelh
+from sh_t import progress
+from sh_t import bipartitions
+from sh_t import main
+from sh_t import scheduler
+from sh_t.scheduler import Job, run_jobs
 
 class TestAlignments:
     def test_correct_aligments(self):
@@ -62,3 +85,927 @@ class TestAlignments:
         with pytest.raises(core.GroupError):
             core.satisfy_all_taxon_groups(test_alignment, group_set)
 
+
+def record_upstream(work, upstream):
+    return work, sorted(upstream.items())
+
+
+def fail(work, upstream):
+    raise ValueError(work)
+
+
+def nap(work, upstream):
+    time.sleep(work)
+
+
+def fail_first(work, upstream):
+    """Fail on the first attempt only, and report the attempt that ran"""
+    if scheduler.get_attempt() == 0:
+        raise ValueError(work)
+    return scheduler.get_attempt()
+
+
+def straggle_first(work, upstream):
+    """Take `work` seconds on the first attempt only"""
+    if scheduler.get_attempt() == 0:
+        time.sleep(work)
+    return scheduler.get_attempt()
+
+
+class TestScheduler:
+    def test_dependencies_run_first(self):
+        jobs = [
+            Job("tests", record_upstream, "t", depends=["best", "c1"]),
+            Job("best", record_upstream, "b"),
+            Job("c1", record_upstream, "c")
+        ]
+        observed = [(job.name, result) for job, result in run_jobs(jobs)]
+        assert [name for name, result in observed] == ["best", "c1", "tests"]
+        assert observed[-1][1] == ("t", [("best", ("b", [])), ("c1", ("c", []))])
+
+    def test_unknown_dependency(self):
+        jobs = [Job("tests", record_upstream, "t", depends=["best"])]
+        with pytest.raises(ValueError):
+            list(run_jobs(jobs))
+
+    def test_thread_runner(self):
+        jobs = [
+            Job("tests", record_upstream, "t", depends=["best", "c1"]),
+            Job("best", record_upstream, "b"),
+            Job("c1", record_upstream, "c")
+        ]
+        observed = dict([(job.name, result) for job, result in run_jobs(jobs, 2, "threads")])
+        assert observed["tests"] == ("t", [("best", ("b", [])), ("c1", ("c", []))])
+
+    def test_memory_limit(self):
+        jobs = [
+            Job("big1", nap, 0.2),
+            Job("big2", nap, 0.2),
+            Job("small1", nap, 0.05),
+            Job("small2", nap, 0.05)
+        ]
+        for job, size in zip(jobs, [6, 6, 2, 2]):
+            job.memory = size
+        finished = [job for job, result in run_jobs(jobs, 4, "threads", max_memory=10)]
+        big1, big2 = jobs[:2]
+        # the big jobs never overlap, and the small ones fill in around them
+        assert big1.finished <= big2.started
+        assert all([job.started < big1.finished for job in jobs[2:]])
+        assert len(finished) == 4
+
+    def test_thread_limit(self):
+        jobs = [Job("wide", nap, 0.2, threads=3), Job("narrow1", nap, 0.05), Job("narrow2", nap, 0.05)]
+        list(run_jobs(jobs, 4, "threads"))
+        wide, narrow1, narrow2 = jobs
+        # one single-threaded job fits beside the wide job, the next waits
+        assert narrow1.started < wide.finished
+        assert narrow2.started >= narrow1.finished
+
+    def test_job_failure(self):
+        jobs = [
+            Job("tests", record_upstream, "t", depends=["best"]),
+            Job("best", fail, "b"),
+            Job("other", record_upstream, "o")
+        ]
+        jobs[1].retries = 1
+        finished = [job for job, result in run_jobs(jobs)]
+        # the failure is retried once, then the rest of the graph carries on
+        assert sorted([job.name for job in finished]) == ["best", "other"]
+        assert jobs[1].attempts == 2
+        assert "ValueError" in jobs[1].error
+        assert jobs[2].error is None
+
+    def test_retry_gets_new_attempt(self):
+        jobs = [Job("best", fail_first, "b")]
+        jobs[0].retries = 1
+        observed = [(job.name, result) for job, result in run_jobs(jobs)]
+        assert observed == [("best", 1)]
+        assert jobs[0].error is None
+
+    def test_speculate_straggler(self):
+        jobs = [Job("slow", straggle_first, 2.)]
+        jobs[0].cost = 0.05
+        observed = [
+            (result, job.finished - job.started)
+            for job, result in run_jobs(jobs, 2, "threads", speculate=2., poll=0.05)
+        ]
+        # the duplicate finished first and the straggler was dropped
+        assert observed[0][0] == 1
+        assert observed[0][1] < 2.
+
+
+class TestProgress:
+    def get_jobs(self):
+        jobs = [
+            Job("uce-1.BEST", nap, 0.05, locus="uce-1", stage="BEST"),
+            Job("uce-1.SHTEST", nap, 0.01, depends=["uce-1.BEST"], locus="uce-1", stage="SHTEST"),
+            Job("uce-2.BEST", fail, "b", locus="uce-2", stage="BEST"),
+            Job("uce-2.SHTEST", nap, 0.01, depends=["uce-2.BEST"], locus="uce-2", stage="SHTEST")
+        ]
+        for job in jobs:
+            job.cost = 1.
+        return jobs
+
+    @pytest.mark.parametrize("runner", ["threads", "processes"])
+    def test_events(self, runner):
+        events = []
+        list(run_jobs(self.get_jobs(), 2, runner, progress=events.append, poll=0.01))
+        kinds = [(event["event"], event.get("job")) for event in events if event["event"] != "tick"]
+        # starts are sent by the pool, finishes by the scheduler
+        assert sorted(kinds) == [
+            ("done", "uce-1.BEST"),
+            ("done", "uce-1.SHTEST"),
+            ("failed", "uce-2.BEST"),
+            ("start", "uce-1.BEST"),
+            ("start", "uce-1.SHTEST"),
+            ("start", "uce-2.BEST")
+        ]
+        assert all(["duration" in event for event in events if event["event"] == "done"])
+
+    def test_status_file(self, tmpdir):
+        jobs = self.get_jobs()
+        status_pth = str(tmpdir.join(progress.STATUS_NAME))
+        tracker = progress.Progress(jobs, status_pth, interval=0.)
+        list(run_jobs(jobs, 2, "threads", progress=tracker.update, poll=0.01))
+        tracker.finish()
+        with open(status_pth) as infile:
+            status = json.load(infile)
+        assert status["loci"] == {"total": 2, "done": 1, "failed": 1, "per_hour": status["loci"]["per_hour"]}
+        assert status["jobs"]["done"] == 2
+        assert status["jobs"]["failed"] == 1
+        assert status["running"] == []
+        assert status["stages"]["BEST"]["done"] == 1
+        assert tracker.get_eta(time.time()) >= 0
+        assert os.listdir(str(tmpdir)) == [progress.STATUS_NAME]
+
+
+class TestDatabase:
+    def test_rows_visible_after_locus(self, tmpdir):
+        args = argparse.Namespace(output=str(tmpdir))
+        conn, cur = db.create_results_database(args, logging.getLogger("test"))
+        sh_tests = [(
+            "RAxML_bestTree.uce-10.characif.constraint.BEST",
+            "-1000.5", "-1.5", "2.25", "Yes", "No", "No", 0.03, 0.02, 0.04, 0.1
+        )]
+        db.insert_sh_test_results(cur, "uce-10", sh_tests)
+        conn.commit()
+        # read through a second connection while the first is still open
+        reader = sqlite3.connect(str(tmpdir.join("sh_test_results.sqlite")))
+        rows = reader.execute("SELECT locus, tree, ll FROM results").fetchall()
+        assert rows == [(u"uce-10", u"characif", -1000.5)]
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == u"wal"
+
+
+class TestCache:
+    def test_store_and_fetch(self, tmpdir):
+        cache_dir = str(tmpdir.join("cache"))
+        tree = tmpdir.join("RAxML_bestTree.uce-10.BEST")
+        tree.write("(a,b,(c,d));\n")
+        key = cache.get_key("uce-10", 20, 1234, "8.2.12")
+        assert cache.fetch(cache_dir, key, {"bestTree": str(tmpdir.join("out"))}) is False
+        cache.store(cache_dir, key, {"bestTree": str(tree)})
+        assert cache.fetch(cache_dir, key, {"bestTree": str(tmpdir.join("out"))}) is True
+        assert tmpdir.join("out").read() == "(a,b,(c,d));\n"
+
+    def test_key_depends_on_inputs(self):
+        assert cache.get_key("aln", 20, 1234) == cache.get_key("aln", 20, 1234)
+        assert cache.get_key("aln", 20, 1234) != cache.get_key("aln", 10, 1234)
+
+    def test_no_cache(self, tmpdir):
+        assert cache.fetch(None, "abc", {"bestTree": str(tmpdir.join("out"))}) is False
+
+    def test_default_cache(self, tmpdir):
+        from sh_t.cli.main import get_args
+        argv = ["--config", "sh_t.yaml", "--alignments", str(tmpdir), "--output", str(tmpdir.join("output"))]
+        # the cache survives the output dir being replaced
+        assert get_args(argv).cache == str(tmpdir.join("output.cache"))
+        assert get_args(argv + ["--cache", str(tmpdir.join("cache"))]).cache == str(tmpdir.join("cache"))
+        with pytest.raises(SystemExit):
+            get_args(argv + ["--cache", str(tmpdir.join("output", "cache"))])
+
+
+class TestScanAlignment:
+    def test_sequential(self):
+        test_alignment = os.path.join(
+                os.path.dirname(__file__),
+                "alignments",
+                "uce-19.phylip"
+            )
+        ntax, nchar, taxa = core.scan_alignment(test_alignment)
+        assert (ntax, nchar) == (33, 1779)
+        assert len(taxa) == 33
+        assert "apteronotus_albifrons" in taxa
+
+    def test_interleaved(self, tmpdir):
+        alignment = tmpdir.join("uce-1.phylip")
+        alignment.write(
+            " 3 8\n"
+            "taxon_a  ACGT\n"
+            "taxon_b  AC-T\n"
+            "taxon_c  ??GT\n"
+            "\n"
+            "ACGT\n"
+            "ACGT\n"
+            "ACGT\n"
+        )
+        assert core.scan_alignment(str(alignment)) == (
+            3, 8, frozenset(["taxon_a", "taxon_b", "taxon_c"])
+        )
+
+    def test_truncated(self, tmpdir):
+        alignment = tmpdir.join("uce-2.phylip")
+        alignment.write("3 4\ntaxon_a ACGT\n")
+        with pytest.raises(ValueError):
+            core.scan_alignment(str(alignment))
+
+
+class TestTaxonGroupCoverage:
+    def test_coverage_matrix(self):
+        test_alignments = os.path.join(
+                os.path.dirname(__file__),
+                "alignments"
+            )
+        alignments = sorted(core.get_alignments(test_alignments))
+        group_set = {
+            "clupeiforms": [
+                "thryssa_hamiltonii2",
+                "chirocentrus_dorab2",
+                "dorosoma_pentense"
+            ],
+            "nothing": ["not_a_taxon"]
+        }
+        group_names, coverage = core.get_taxon_group_coverage(alignments, group_set)
+        assert group_names == ["clupeiforms", "nothing"]
+        assert coverage.shape == (len(alignments), 2)
+        observed = [os.path.basename(a) for a, ok in zip(alignments, coverage[:, 0]) if not ok]
+        assert observed == ["uce-508.phylip"]
+        assert not coverage[:, 1].any()
+
+    def test_all_missing_groups_reported(self):
+        test_alignment = os.path.join(
+                os.path.dirname(__file__),
+                "alignments",
+                "uce-10.phylip"
+            )
+        group_set = {"a": ["not_a_taxon"], "b": ["dorosoma_pentense"], "c": ["nope"]}
+        with pytest.raises(core.GroupError) as e:
+            core.satisfy_all_taxon_groups(test_alignment, group_set)
+        assert e.value.group == "a, c"
+
+
+class TestConstraints:
+    def test_pruned_constraint_is_cached(self):
+        constraint = ("test", "(a:2.0,b:1.0,(c:0.5,(d:1.0,e:1.0):0.25):1.0);")
+        first = constraints.get_pruned_constraint(constraint, set(["a", "b", "c", "d", "x"]))
+        hits = constraints._pruned_constraints.hits
+        second = constraints.get_pruned_constraint(constraint, set(["a", "b", "c", "d", "y"]))
+        assert first == second
+        assert constraints._pruned_constraints.hits == hits + 1
+        assert "e" not in first
+        assert "2.0" not in first
+
+    def test_lru_evicts_oldest(self):
+        lru = constraints.LRUCache(maxsize=2)
+        lru.put("a", 1)
+        lru.put("b", 2)
+        lru.get("a")
+        lru.put("c", 3)
+        assert lru.get("b") is None
+        assert lru.get("a") == 1
+
+    def test_distinct_constraints(self):
+        constraint_strings = {
+            "one": "(a,b,(c,d),(e,x));",
+            "two": "((d,c),b,a,(e,y));",
+            "star": "(a,b,c,(d,z));",
+            "three": "(a,c,(b,d),e);"
+        }
+        constraint_map, searches = constraints.get_distinct_constraints(
+            constraint_strings,
+            set(["a", "b", "c", "d", "e"])
+        )
+        assert constraint_map == [
+            ("one", "one"),
+            ("star", None),
+            ("three", "three"),
+            ("two", "one")
+        ]
+        assert searches["one"] == frozenset([frozenset(["c", "d"])])
+
+    def test_distinct_constraints_keep_taxa(self):
+        # f is free under A, but kept out of (d,e) under B
+        constraint_strings = {"A": "(a,b,c,(d,e));", "B": "(a,b,c,f,(d,e));"}
+        taxa = set(["a", "b", "c", "d", "e", "f", "g"])
+        constraint_map, searches = constraints.get_distinct_constraints(constraint_strings, taxa)
+        assert constraint_map == [("A", "A"), ("B", "B")]
+        keys = [
+            main.get_search_key("locus", taxa, (name, newick))
+            for name, newick in sorted(constraint_strings.items())
+        ]
+        assert keys[0] != keys[1]
+
+    def test_newick_taxa(self):
+        import dendropy
+        newicks = [
+            "(a:1.0,b:1.0,(c:0.5,(d:1.0,e:1.0):0.25):1.0);",
+            "('a b':1.0,[note]c,(d,e)90:0.1);",
+            "((a,b)ab,(c,(d,e)de)cde);"
+        ]
+        for newick in newicks:
+            tree = dendropy.Tree.get_from_string(newick, "newick", preserve_underscores=True)
+            expected = set([leaf.taxon.label for leaf in tree.leaf_nodes()])
+            assert constraints.get_newick_taxa(newick) == expected
+        assert constraints.get_newick_taxa("('a b':1.0,[note]c,(d,e)90:0.1);") == set(["a b", "c", "d", "e"])
+
+
+class TestShards:
+    def make_shard(self, tmpdir, shard, ll):
+        info = tmpdir.join("RAxML_info.uce-1.BEST.shard{}".format(shard))
+        info.write("Final GAMMA-based Score of best tree {}\n".format(ll))
+        tree = tmpdir.join("RAxML_bestTree.uce-1.BEST.shard{}".format(shard))
+        tree.write("shard{}\n".format(shard))
+        return {"bestTree": str(tree), "info": str(info)}
+
+    def test_pick_most_likely_shard(self, tmpdir):
+        shards = [
+            self.make_shard(tmpdir, 0, -1200.5),
+            self.make_shard(tmpdir, 1, -1100.25),
+            self.make_shard(tmpdir, 2, -1100.25)
+        ]
+        search_files = main.get_search_files(str(tmpdir), "uce-1", "BEST")
+        main.pick_best_shard(shards, search_files)
+        assert tmpdir.join("RAxML_bestTree.uce-1.BEST").read() == "shard1\n"
+
+    def test_replicates_split_across_shards(self):
+        args = argparse.Namespace(shards=3, searches=20, adaptive=False)
+        locus = (args, "raxml", "uce-1", "/tmp", "/tmp/uce-1.phylip", "key", frozenset(), None)
+        jobs = main.get_search_jobs(args, locus, None)
+        assert [job.name for job in jobs] == [
+            "uce-1.BEST.shard0",
+            "uce-1.BEST.shard1",
+            "uce-1.BEST.shard2",
+            "uce-1.BEST"
+        ]
+        assert [job.work[-1] for job in jobs[:-1]] == [7, 7, 6]
+        assert jobs[-1].depends == [job.name for job in jobs[:-1]]
+
+
+class TestAdaptiveSearch:
+    def test_stops_when_converged(self, tmpdir, monkeypatch):
+        lls = [-100., -99., -98.95, -98.92, -50.]
+        def fake_search(work, constraint, searches, seed, postfix):
+            batch = int(postfix.split("batch")[-1])
+            files = main.get_search_files(str(tmpdir), "uce-1", postfix)
+            with open(files["info"], 'w') as outfile:
+                outfile.write("Final GAMMA-based Score of best tree {}\n".format(lls[batch]))
+            with open(files["bestTree"], 'w') as outfile:
+                outfile.write("batch{}\n".format(batch))
+            return files
+        monkeypatch.setattr(main, "run_search", fake_search)
+        args = argparse.Namespace(batch_searches=4, max_searches=100, tolerance=0.1, patience=2)
+        search_files = main.get_search_files(str(tmpdir), "uce-1", "BEST")
+        work = (args, "raxml", "uce-1", str(tmpdir))
+        # the last two batches gain less than the tolerance
+        assert main.run_adaptive_search(work, None, "key", "BEST", search_files) == 16
+        assert tmpdir.join("RAxML_bestTree.uce-1.BEST").read() == "batch3\n"
+        assert sorted(os.listdir(str(tmpdir))) == ["RAxML_bestTree.uce-1.BEST", "RAxML_info.uce-1.BEST"]
+        # the cap ends a search that keeps improving
+        args.max_searches, args.tolerance = 6, -1000.
+        assert main.run_adaptive_search(work, None, "key", "BEST", search_files) == 6
+
+
+def make_cost_jobs():
+    jobs = [
+        Job("small.BEST", record_upstream, None, stage="BEST", units=1.),
+        Job("small.SHTEST", record_upstream, None, depends=["small.BEST"], stage="SHTEST", units=1.),
+        Job("big.BEST", record_upstream, None, stage="BEST", units=10.),
+        Job("big.SHTEST", record_upstream, None, depends=["big.BEST"], stage="SHTEST", units=1.)
+    ]
+    return costs.set_job_costs(jobs, {"BEST": 1., "SHTEST": 1.})
+
+
+class TestCosts:
+    def test_longest_first(self):
+        observed = [job.name for job, result in run_jobs(make_cost_jobs())]
+        assert observed == ["big.BEST", "small.BEST", "small.SHTEST", "big.SHTEST"]
+
+    def test_makespan(self):
+        assert costs.estimate_makespan(make_cost_jobs(), 1) == 13.
+        assert costs.estimate_makespan(make_cost_jobs(), 2) == 11.
+
+    def test_threaded_makespan(self):
+        jobs = make_cost_jobs()
+        jobs[2].threads = 2
+        costs.set_job_costs(jobs, {"BEST": 1., "SHTEST": 1.})
+        assert jobs[2].cost == 5.
+        # big.BEST holds both cores, then the rest run two at a time
+        assert costs.estimate_makespan(jobs, 2) == 7.
+
+    def test_learned_rates(self, tmpdir):
+        args = argparse.Namespace(output=str(tmpdir))
+        conn, cur = db.create_results_database(args, logging.getLogger("test"))
+        job = Job("uce-1.BEST", record_upstream, None, locus="uce-1", stage="BEST", units=100.)
+        job.started, job.finished = 10., 15.
+        db.insert_timing(cur, job)
+        conn.commit()
+        rates = costs.load_rates([str(tmpdir.join("sh_test_results.sqlite"))])
+        assert rates["BEST"] == 0.05
+        assert rates["SHTEST"] == costs.DEFAULT_RATES["SHTEST"]
+
+
+class TestCommands:
+    def test_records_resource_use(self):
+        commands.drain()
+        record, stdout = commands.run(["sh", "-c", "echo hello; exit 3"], "BEST", "uce-1", "characif")
+        assert stdout == "hello\n"
+        assert record.returncode == 3
+        assert record.wall >= 0
+        assert record.maxrss_kb > 0
+        assert commands.drain() == [record]
+        assert commands.drain() == []
+
+    def test_timeout(self):
+        commands.set_timeout(0.2)
+        try:
+            with pytest.raises(commands.CommandError):
+                commands.check(["sleep", "10"], "BEST", "uce-1")
+        finally:
+            commands.set_timeout(None)
+        record = commands.drain()[-1]
+        assert record.timed_out
+        assert record.wall < 10
+
+    def test_check_exit_status(self):
+        with pytest.raises(commands.CommandError):
+            commands.check(["sh", "-c", "echo oops; exit 1"], "BEST")
+        record, stdout = commands.check(["true"], "BEST")
+        assert record.returncode == 0
+
+    def test_runs_in_cwd(self, tmpdir):
+        owd = os.getcwd()
+        record, stdout = commands.run(["pwd"], "BEST", cwd=str(tmpdir))
+        assert os.path.realpath(stdout.strip()) == os.path.realpath(str(tmpdir))
+        assert os.getcwd() == owd
+
+
+class TestStats:
+    def test_read_site_lls(self, tmpdir):
+        pth = tmpdir.join("RAxML_perSiteLLs.uce-1.sitelh")
+        pth.write("2 3\ntr1\t-1.5 -2.0 -3.0\ntr2\t-1.0 -2.5 -3.5\n")
+        site_lls = stats.read_site_lls(str(pth))
+        assert site_lls.shape == (2, 3)
+        assert site_lls[1].tolist() == [-1.0, -2.5, -3.5]
+
+    def test_norm_ppf(self):
+        for p in [0.001, 0.05, 0.5, 0.9, 0.999]:
+            assert abs(stats.norm_cdf(stats.norm_ppf(p)) - p) < 1e-9
+
+    def test_tree_tests(self):
+        rng = numpy.random.RandomState(1)
+        best = rng.normal(-5., 1., 500)
+        # one tree a little worse than the best tree, one much worse
+        site_lls = numpy.vstack([best + rng.normal(-0.01, 0.3, 500), best + rng.normal(-0.5, 0.3, 500), best])
+        tests = stats.tree_tests(site_lls, 500, 42)
+        assert tests["delta"][2] == 0
+        assert tests["delta"][1] < tests["delta"][0] < 0
+        for test in ["sh", "kh", "au"]:
+            assert tests[test][0] > 0.05
+            assert tests[test][1] < 0.01
+        assert abs(tests["elw"].sum() - 1) < 1e-9
+        assert tests["elw"][2] > tests["elw"][0] > tests["elw"][1]
+        # the same seed gives the same p-values
+        assert stats.tree_tests(site_lls, 500, 42)["au"].tolist() == tests["au"].tolist()
+
+
+class TestSiteLLStore:
+    def test_round_trip(self, tmpdir):
+        args = argparse.Namespace(output=str(tmpdir))
+        conn, cur = db.create_results_database(args, logging.getLogger("test"))
+        store = sitelh.create_store(conn, cur, str(tmpdir), "float32")
+        first = numpy.arange(6, dtype=numpy.float64).reshape(2, 3) * -1
+        second = numpy.arange(8, dtype=numpy.float64).reshape(2, 4) * -2
+        offset = sitelh.write_site_lls(cur, store, first)
+        sitelh.index_site_lls(cur, "uce-1", ["characif", "BEST"], offset, 3)
+        # another worker appends in between
+        with open(sitelh.open_store(cur, str(tmpdir)), 'ab') as other:
+            other.write(numpy.zeros(5, dtype=numpy.float32).tostring())
+        offset = sitelh.write_site_lls(cur, store, second)
+        sitelh.index_site_lls(cur, "uce-2", ["characif", "BEST"], offset, 4)
+        conn.commit()
+        data, index = sitelh.load_store(str(tmpdir.join("sh_test_results.sqlite")))
+        assert isinstance(data, numpy.memmap)
+        assert data.dtype == numpy.float32
+        trees, site_lls = sitelh.get_locus_site_lls(data, index, "uce-2")
+        assert trees == ["characif", "BEST"]
+        assert site_lls.tolist() == second.tolist()
+        # loci are views into the store, not copies
+        assert numpy.may_share_memory(site_lls, data)
+        assert sitelh.get_tree_site_lls(data, index, "uce-1", "BEST").tolist() == [-3, -4, -5]
+        concatenated = sitelh.concatenate_site_lls(data, index, ["BEST", "characif"])
+        assert concatenated.shape == (2, 7)
+        assert concatenated[0].tolist() == first[1].tolist() + second[1].tolist()
+
+
+class TestCompress:
+    def get_matrix(self):
+        taxa = ["a", "b", "c", "d"]
+        seqs = ["AC-AGA", "AC-AGA", "ANNTGT", "------"]
+        return taxa, numpy.array([list(seq) for seq in seqs], dtype="S1")
+
+    def test_compress_alignment(self):
+        taxa, matrix = self.get_matrix()
+        kept, dropped, patterns, weights, site_map = compress.compress_alignment(taxa, matrix)
+        assert kept == ["a", "b", "c"]
+        assert dropped == ["d"]
+        # the all-gap column is dropped, and N counts as missing
+        assert ["".join(row) for row in patterns] == ["ACAG", "ACAG", "A-TG"]
+        assert weights.tolist() == [1, 1, 2, 1]
+        assert site_map.tolist() == [0, 1, -1, 2, 3, 2]
+
+    def test_read_phylip(self):
+        taxa, matrix = compress.read_phylip(os.path.join(os.path.dirname(__file__), "alignments", "uce-10.phylip"))
+        assert matrix.shape == (32, 283)
+        assert taxa[0] == "ameirus_natalis2"
+        assert "".join(matrix[0, :10]) == "CAGCACCACC"
+
+    def test_count_patterns(self, tmpdir):
+        taxa, matrix = self.get_matrix()
+        pth = tmpdir.join("uce-1.phylip")
+        compress.write_phylip(str(pth), taxa, matrix)
+        assert compress.count_patterns(str(pth)) == 4
+        # the alignment isn't kept
+        assert str(pth) not in [key[0] for key in compress._compressed_alignments]
+
+    def test_stage_and_expand(self, tmpdir):
+        taxa, matrix = self.get_matrix()
+        pth = tmpdir.join("uce-1.phylip")
+        compress.write_phylip(str(pth), taxa, matrix)
+        working_alignment, compression = compress.stage_compressed_alignment(str(pth), str(tmpdir), "uce-1")
+        assert core.scan_alignment(working_alignment)[:2] == (3, 4)
+        # the staged files stand in for the alignment in memory
+        assert compress.get_memo_key(str(pth)) not in compress._compressed_alignments
+        assert tmpdir.join("uce-1.weights").read().split() == ["1", "1", "2", "1"]
+        site_lls = numpy.array([[-1., -2., -3., -4.]])
+        expanded = compress.expand_site_lls(site_lls, compression[1])
+        assert expanded.tolist() == [[-1., -2., 0., -3., -4., -3.]]
+        # weighted patterns sum to the same likelihood as the full columns
+        assert expanded.sum() == (site_lls * numpy.array([1, 1, 2, 1])).sum()
+
+
+class TestStaging:
+    def test_link_or_copy(self, tmpdir):
+        src = tmpdir.join("uce-1.phylip")
+        src.write("1 1\na A\n")
+        dst = tmpdir.join("uce-1.staged.phylip")
+        core.link_or_copy(str(src), str(dst))
+        # staging again replaces the old link
+        core.link_or_copy(str(src), str(dst))
+        assert dst.read() == "1 1\na A\n"
+        assert os.path.samefile(str(src), str(dst))
+
+    def test_cleanup_raxml_temp_files(self, tmpdir):
+        for name in ["RAxML_log.uce-1.BEST.RUN.0", "RAxML_result.uce-1.BEST.RUN.12", "RAxML_info.uce-1.BEST"]:
+            tmpdir.join(name).write("")
+        main.cleanup_raxml_temp_files(str(tmpdir), "uce-1", "BEST")
+        assert os.listdir(str(tmpdir)) == ["RAxML_info.uce-1.BEST"]
+
+    def test_stage_clears_attempts(self, tmpdir):
+        alignment = tmpdir.join("uce-1.phylip")
+        alignment.write("1 1\na A\n")
+        # markers left by an interrupted run
+        tmpdir.mkdir("output").mkdir("uce-1").mkdir(main.ATTEMPTS).join("BEST.claimed").write("")
+        args = argparse.Namespace(output=str(tmpdir.join("output")), scratch=None, compress=False)
+        working_dir = main.stage_locus(args, str(alignment))[1]
+        assert not os.path.exists(os.path.join(working_dir, main.ATTEMPTS))
+
+    def test_pack_locus(self, tmpdir):
+        working_dir = tmpdir.mkdir("uce-1")
+        working_dir.join("RAxML_bestTree.uce-1.BEST").write("(a,b,c);\n")
+        main.pack_locus_tar(str(tmpdir), "uce-1", str(working_dir))
+        with tarfile.open(str(tmpdir.join("uce-1.tar.gz"))) as tar:
+            assert tar.getnames() == ["uce-1/RAxML_bestTree.uce-1.BEST"]
+        args = argparse.Namespace(output=str(tmpdir))
+        conn, cur = db.create_results_database(args, logging.getLogger("test"))
+        db.insert_artifacts(cur, "uce-1", db.read_artifacts(str(working_dir)))
+        conn.commit()
+        db.extract_artifacts(cur, "uce-1", str(tmpdir.join("extracted")))
+        assert tmpdir.join("extracted", "RAxML_bestTree.uce-1.BEST").read() == "(a,b,c);\n"
+
+
+class TestMemory:
+    def test_parse_memory(self):
+        assert memory.parse_memory("512") == 512 * 1024
+        assert memory.parse_memory("2G") == 2 * 1024 ** 2
+        assert memory.parse_memory("64kb") == 64
+        with pytest.raises(ValueError):
+            memory.parse_memory("lots")
+
+    def test_observe_refines_predictions(self):
+        footprint = memory.get_footprint(34, 1024)
+        assert footprint == 32 * 1024 * 16 * 8 / 1024.
+        jobs = [
+            Job("uce-1.BEST", record_upstream, None, stage="BEST", footprint=footprint),
+            Job("uce-2.BEST", record_upstream, None, stage="BEST", footprint=2 * footprint),
+            Job("uce-2.SHTEST", record_upstream, None, stage="SHTEST", footprint=2 * footprint)
+        ]
+        ratios = {}
+        memory.set_job_memory(jobs, ratios)
+        assert jobs[1].memory == memory.BASE_KB + 2 * footprint
+        # uce-1 used three times the modelled memory
+        jobs[0].records = [commands.CommandRecord("uce-1", "BEST", None, 1., 1., 0., memory.BASE_KB + 3 * footprint, 0)]
+        memory.observe(jobs, ratios, jobs[0])
+        assert ratios == {"BEST": 3.}
+        assert jobs[1].memory == memory.BASE_KB + 6 * footprint
+        assert jobs[2].memory == memory.BASE_KB + 2 * footprint
+
+
+class TestRaxmlBuilds:
+    def make_builds(self, tmpdir, names):
+        for name in names:
+            pth = tmpdir.join(name)
+            pth.write("#!/bin/sh\n")
+            pth.chmod(0755)
+
+    def test_find_raxml_builds(self, tmpdir, monkeypatch):
+        self.make_builds(tmpdir, ["raxmlHPC-SSE3", "raxmlHPC-PTHREADS-SSE3", "raxmlHPC-AVX"])
+        monkeypatch.setenv("PATH", str(tmpdir))
+        monkeypatch.setattr(core, "get_cpu_flags", lambda: set(["pni", "avx"]))
+        assert core.find_raxml_builds() == {
+            "serial": str(tmpdir.join("raxmlHPC-AVX")),
+            "pthreads": str(tmpdir.join("raxmlHPC-PTHREADS-SSE3"))
+        }
+        # never pick a build the cpu can't run
+        monkeypatch.setattr(core, "get_cpu_flags", lambda: set(["pni"]))
+        assert core.find_raxml_builds()["serial"] == str(tmpdir.join("raxmlHPC-SSE3"))
+
+    def test_threads_by_patterns(self):
+        args = argparse.Namespace(cores=4, patterns_per_thread=1000)
+        builds = {"serial": "raxmlHPC-SSE3", "pthreads": "raxmlHPC-PTHREADS-SSE3"}
+        assert main.get_raxml_command(args, builds, 1500) == (["raxmlHPC-SSE3"], 1)
+        assert main.get_raxml_command(args, builds, 2500) == (["raxmlHPC-PTHREADS-SSE3", "-T", "2"], 2)
+        assert main.get_raxml_command(args, builds, 90000)[1] == 4
+        builds["pthreads"] = None
+        assert main.get_raxml_command(args, builds, 90000) == (["raxmlHPC-SSE3"], 1)
+
+    def test_threads_from_header(self, tmpdir, monkeypatch):
+        from sh_t.cli.main import get_args
+        args = get_args([
+            "--config", str(tmpdir.join("sh_t.yaml")),
+            "--alignments", str(tmpdir),
+            "--output", str(tmpdir.join("output")),
+            "--cores", "4",
+            "--patterns-per-thread", "100"
+        ])
+        # the alignment is never read past its header
+        monkeypatch.setattr(compress, "get_compressed_alignment", None)
+        alignment = os.path.join(os.path.dirname(__file__), "alignments", "uce-10.phylip")
+        builds = {"serial": "raxmlHPC-SSE3", "pthreads": "raxmlHPC-PTHREADS-SSE3"}
+        jobs = main.get_locus_jobs(args, builds, "8.0.0", alignment, {})
+        nchar = core.scan_alignment(alignment)[1]
+        assert jobs[0].threads == min(4, nchar // 100)
+
+
+class TestBipartitions:
+    trees = [
+        "(a:0.1,b:0.2,(c:0.3,(d:0.1,(e:0.2,f:0.1):0.3):0.2):0.1);",
+        "(a:0.1,c:0.2,(b:0.3,(d:0.1,(e:0.2,f:0.1)90:0.3):0.2):0.1);",
+        "((a,b),(c,d),(e,f));",
+        "('a':1.0,[comment]f,(e,(d,(c,b))));"
+    ]
+
+    def test_rf_matches_dendropy(self):
+        import dendropy
+        from dendropy.calculate import treecompare
+        taxon_index = {}
+        for first in self.trees:
+            for second in self.trees:
+                namespace = dendropy.TaxonNamespace()
+                first_tree = dendropy.Tree.get_from_string(first, "newick", taxon_namespace=namespace)
+                second_tree = dendropy.Tree.get_from_string(second, "newick", taxon_namespace=namespace)
+                first_tree.encode_bipartitions()
+                second_tree.encode_bipartitions()
+                rf, max_rf = bipartitions.rf_distance(
+                    bipartitions.get_splits(bipartitions.tokenize(first), taxon_index),
+                    bipartitions.get_splits(bipartitions.tokenize(second), taxon_index)
+                )
+                assert rf == treecompare.symmetric_difference(first_tree, second_tree)
+                assert max_rf == 6
+
+    def test_constraint_pruned_to_locus(self):
+        trees = {"BEST": self.trees[0], "one": self.trees[1], "two": self.trees[0]}
+        # x is not in the locus, so (b,x) says nothing about it
+        constraints = {"one": "((a,b),(c,(d,x)),(e,f));", "two": "((b,x),a,c,d,e,f);"}
+        rows = bipartitions.compare_loci([("uce-1", trees)], constraints)
+        assert rows == [
+            ("uce-1", "one", 6, 2, 6, 3, 2, "c,d"),
+            ("uce-1", "two", 6, 0, 6, 0, 0, "")
+        ]
+
+    def test_compare_trees(self, tmpdir):
+        args = argparse.Namespace(output=str(tmpdir))
+        log = logging.getLogger("test")
+        conn, cur = db.create_results_database(args, log)
+        db.insert_constraints(conn, cur, {"one": "((a,b),(c,(d,x)),(e,f));"})
+        for name, newick in (("BEST", self.trees[0]), ("one", self.trees[1])):
+            tmpdir.join(name).write(newick + "\n")
+        db.insert_trees(cur, "uce-1", db.read_trees([(name, str(tmpdir.join(name))) for name in ("BEST", "one")]))
+        conn.commit()
+        assert main.compare_trees(conn, cur, log) == 1
+        # loci are only compared once
+        assert main.compare_trees(conn, cur, log) == 0
+        rows = cur.execute("SELECT locus, tree, rf, clades_in_best FROM tree_comparisons").fetchall()
+        assert rows == [(u"uce-1", u"one", 2, 2)]
+
+
+class TestDryRun:
+    config = """orders:
+    clupeiforms:
+        - thryssa_hamiltonii2
+        - chirocentrus_dorab2
+        - dorosoma_pentense
+constraints:
+    one: "(ameirus_natalis2,apteronotus_albifrons,(astynax_aeneus,(citharinus_gibbosus,dorosoma_pentense)),no_such_taxon);"
+"""
+
+    def test_dry_run_writes_nothing(self, tmpdir, capsys, monkeypatch):
+        from sh_t.cli.main import get_args
+        monkeypatch.setenv("PATH", str(tmpdir))
+        config = tmpdir.join("sh_t.yaml")
+        config.write(self.config)
+        output = tmpdir.join("output")
+        args = get_args([
+            "--config", str(config),
+            "--alignments", os.path.join(os.path.dirname(__file__), "alignments"),
+            "--output", str(output),
+            "--dry-run"
+        ])
+        assert main.dry_run(args) == 0
+        out = capsys.readouterr()[0]
+        assert "Dropped uce-508.phylip: missing taxa from 'clupeiforms'" in out
+        assert "Alignments: 6 of 7 usable" in out
+        assert "Constraint 'one': 6 taxa, 1 in no usable alignment" in out
+        assert "Jobs: at most 18 for 6 loci" in out
+        assert not output.check()
+
+    def test_bad_config(self, tmpdir):
+        config = tmpdir.join("bad.yaml")
+        config.write("orders:\n  one: [a, b]\n")
+        with pytest.raises(ValueError):
+            main.load_config(str(config))
+
+
+def make_queue(tmpdir, jobs):
+    db_pth = str(tmpdir.join("queue.sqlite"))
+    conn = jobqueue.connect(db_pth)
+    jobqueue.create_queue(conn)
+    conn.execute("CREATE TABLE ran (name text, worker text)")
+    jobqueue.enqueue_jobs(conn, jobs)
+    return db_pth, conn
+
+
+def queue_worker(db_pth, worker):
+    conn = jobqueue.connect(db_pth)
+    record = lambda job, result, stored: conn.execute("INSERT INTO ran VALUES (?,?)", (job.name, worker))
+    jobqueue.run_worker(conn, db_pth, worker, lease=30., poll=0.05, record=record)
+    conn.close()
+
+
+class TestJobQueue:
+    def get_jobs(self):
+        return [
+            Job("tests", record_upstream, "t", depends=["best", "c1"]),
+            Job("best", record_upstream, "b"),
+            Job("c1", record_upstream, "c")
+        ]
+
+    def test_claim_and_complete(self, tmpdir):
+        db_pth, conn = make_queue(tmpdir, self.get_jobs())
+        first, upstream = jobqueue.claim_job(conn, "w1", 30.)
+        second, upstream = jobqueue.claim_job(conn, "w2", 30.)
+        assert (first.name, second.name) == ("best", "c1")
+        # the tests wait on both searches
+        assert jobqueue.claim_job(conn, "w1", 30.) is None
+        assert jobqueue.complete_job(conn, first, "w1", "best.tre", None)
+        assert jobqueue.complete_job(conn, second, "w2", "c1.tre", None)
+        job, upstream = jobqueue.claim_job(conn, "w1", 30.)
+        assert job.name == "tests"
+        assert upstream == {"best": "best.tre", "c1": "c1.tre"}
+
+    def test_expired_lease(self, tmpdir):
+        jobs = self.get_jobs()
+        jobs[1].retries = 1
+        db_pth, conn = make_queue(tmpdir, jobs)
+        job, upstream = jobqueue.claim_job(conn, "w1", -1.)
+        # w1 stopped renewing its lease, so w2 gets the job
+        again, upstream = jobqueue.claim_job(conn, "w2", 30.)
+        assert again.name == job.name
+        assert not jobqueue.renew_lease(conn, job.name, "w1", 30.)
+        assert not jobqueue.complete_job(conn, job, "w1", "best.tre", None)
+        assert jobqueue.complete_job(conn, again, "w2", "best.tre", None)
+        assert jobqueue.count_jobs(conn) == {"done": 1, "ready": 1, "waiting": 1}
+
+    def test_expired_lease_fails(self, tmpdir):
+        jobs = self.get_jobs()
+        jobs[1].retries = 1
+        db_pth, conn = make_queue(tmpdir, jobs)
+        conn.execute("CREATE TABLE failed (name text, attempts integer, error text)")
+        record_failure = lambda job: conn.execute(
+            "INSERT INTO failed VALUES (?,?,?)", (job.name, job.attempts, job.error)
+        )
+        # the job kills each worker that runs it
+        first, upstream = jobqueue.claim_job(conn, "w1", -1., record_failure)
+        second, upstream = jobqueue.claim_job(conn, "w2", -1., record_failure)
+        assert first.name == second.name == "best"
+        third, upstream = jobqueue.claim_job(conn, "w3", 30., record_failure)
+        assert third.name == "c1"
+        assert conn.execute("SELECT name, attempts, error FROM failed").fetchall() == [
+            (u"best", 2, u"The lease held by w2 expired")
+        ]
+        assert jobqueue.count_jobs(conn) == {"failed": 1, "running": 1, "waiting": 1}
+
+    def test_store_outside_transaction(self, tmpdir):
+        db_pth, conn = make_queue(tmpdir, [Job("best", nap, 0.01)])
+        other = sqlite3.connect(db_pth, timeout=0, isolation_level=None)
+        calls = []
+
+        def store(job, result):
+            # other workers can still write while a job is stored
+            other.execute("BEGIN IMMEDIATE")
+            other.execute("ROLLBACK")
+            calls.append("store")
+            return "stored"
+
+        def record(job, result, stored):
+            calls.append(stored)
+
+        def finish(job):
+            state = other.execute("SELECT state FROM queue WHERE name = ?", (job.name,)).fetchone()[0]
+            calls.append(state)
+
+        assert jobqueue.run_worker(conn, db_pth, "w1", 30., 0.05, store, record, finish) == (1, 0)
+        assert calls == ["store", "stored", u"done"]
+
+    def test_failure_recorded_once(self, tmpdir):
+        jobs = [Job("bad", fail, None), Job("after", nap, 0.01, depends=["bad"]), Job("good", nap, 0.01)]
+        jobs[0].retries = 1
+        db_pth, conn = make_queue(tmpdir, jobs)
+        conn.execute("CREATE TABLE failed (name text, attempts integer)")
+        record_failure = lambda job: conn.execute("INSERT INTO failed VALUES (?,?)", (job.name, job.attempts))
+        counts = jobqueue.run_worker(conn, db_pth, "w1", 30., 0.05, record_failure=record_failure)
+        assert counts == (1, 1)
+        # the failure is only recorded once the retries are used up
+        assert conn.execute("SELECT name, attempts FROM failed").fetchall() == [(u"bad", 2)]
+        assert jobqueue.count_jobs(conn) == {"done": 1, "failed": 1, "waiting": 1}
+
+    def test_local_workers(self, tmpdir):
+        jobs = [Job("locus{}.BEST".format(i), nap, 0.05) for i in range(6)]
+        jobs += [
+            Job("locus{}.SHTEST".format(i), nap, 0.01, depends=["locus{}.BEST".format(i)])
+            for i in range(6)
+        ]
+        db_pth, conn = make_queue(tmpdir, jobs)
+        workers = [multiprocessing.Process(target=queue_worker, args=(db_pth, "w{}".format(i))) for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert jobqueue.count_jobs(conn) == {"done": 12}
+        ran = conn.execute("SELECT name, worker FROM ran").fetchall()
+        # every job ran once, and after its dependency
+        assert sorted([name for name, worker in ran]) == sorted([job.name for job in jobs])
+        order = [name for name, worker in ran]
+        for i in range(6):
+            assert order.index("locus{}.BEST".format(i)) < order.index("locus{}.SHTEST".format(i))
+
+
+class TestPlanAndWork:
+    def test_plan_then_work(self, tmpdir, monkeypatch):
+        from sh_t.cli import main as cli_main
+        # the stub RAxML of the benchmarks, without its delay
+        stub = os.path.join(os.path.dirname(__file__), "..", "bench", "bin")
+        monkeypatch.setenv("PATH", os.pathsep.join([stub, os.environ["PATH"]]))
+        monkeypatch.setenv("SH_T_STUB_DELAY", "0")
+        monkeypatch.chdir(str(tmpdir))
+        config = tmpdir.join("sh_t.yaml")
+        config.write(TestDryRun.config)
+        output = str(tmpdir.join("output"))
+        monkeypatch.setattr("sys.argv", [
+            "sh_t", "plan",
+            "--config", str(config),
+            "--alignments", os.path.join(os.path.dirname(__file__), "alignments"),
+            "--output", output,
+            "--searches", "2",
+            "--replicates", "50"
+        ])
+        cli_main()
+        monkeypatch.setattr("sys.argv", ["sh_t", "work", "--output", output, "--poll", "0.05"])
+        cli_main()
+        db_pth = os.path.join(output, "sh_test_results.sqlite")
+        conn = sqlite3.connect(db_pth)
+        assert jobqueue.count_jobs(conn) == {"done": 18}
+        loci = conn.execute("SELECT DISTINCT locus FROM results").fetchall()
+        assert len(loci) == 6
+        assert conn.execute("SELECT COUNT(*) FROM tree_comparisons").fetchone()[0] == 6
+        conn.close()
+        data, index = sitelh.load_store(db_pth)
+        assert sorted(index) == sorted([locus for locus, in loci])